@@ -3,36 +3,296 @@ import logging
 import urllib3
 import time
 import re
+import threading
 from zoneinfo import ZoneInfo
 import logging
 import requests
 import os
+import queue
+import random
+from requests.adapters import HTTPAdapter
 from kubernetes.client.exceptions import ApiException
 
+# 服务端过滤，只下发 HPA 扩缩容成功事件，其余事件不再经过网络和反序列化
+DEFAULT_FIELD_SELECTOR = "involvedObject.kind=HorizontalPodAutoscaler,type=Normal,reason=SuccessfulRescale"
+
 
 def args_check():
     if not namespaces:
         raise ValueError("请提供有效的命名空间")
 
 
+class TelegramSender(object):
+    """
+    Telegram 异步发送：
+    watch 线程只把消息放入有界队列立即返回，由后台线程池复用 keep-alive 连接发送，
+    发送慢/卡住不会阻塞事件消费；队列满时丢弃并计数
+    - 429: 按返回的 parameters.retry_after 等待后重试
+    - 网络错误/5xx: 指数退避重试，超过次数记为失败
+    """
+
+    API = "https://api.telegram.org/bot{token}/sendMessage"
+
+    def __init__(self, tg_bots, queue_size=1000, workers=2, timeout=(5, 15), max_retries=5):
+        self.tg_bots = tg_bots
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max(len(tg_bots), 1), pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.counters = {"sent": 0, "dropped": 0, "failed": 0, "retries": 0}
+        self.workers = [
+            threading.Thread(target=self._worker, name=f"tg-sender-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self.workers:
+            t.start()
+
+    def _incr(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        """队列深度及发送/丢弃/失败/重试计数"""
+        with self.lock:
+            return dict(self.counters, depth=self.queue.qsize())
+
+    def send(self, msg):
+        """每个 bot 的每个 chat 一条，入队失败（队列满）直接丢弃"""
+        for bot in self.tg_bots:
+            for chat_id in bot["chat_ids"]:
+                try:
+                    self.queue.put_nowait((bot["bot_token"], int(chat_id), msg))
+                except queue.Full:
+                    self._incr("dropped")
+                    logging.warning(f"Telegram 发送队列已满，丢弃发往 {chat_id} 的消息, 状态: {self.stats()}")
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            try:
+                self._deliver(*item)
+            except Exception as e:
+                self._incr("failed")
+                logging.error(f"Failed to send Telegram alert to {item[1]}: {e}", exc_info=True)
+            finally:
+                self.queue.task_done()
+
+    def _deliver(self, bot_token, chat_id, msg):
+        url = self.API.format(token=bot_token)
+        payload = {"chat_id": chat_id, "text": msg}
+        for attempt in range(self.max_retries + 1):
+            try:
+                resp = self.session.post(url, data=payload, timeout=self.timeout)
+            except requests.RequestException as e:
+                delay, reason = self._backoff(attempt), str(e)
+            else:
+                if resp.status_code == 200:
+                    self._incr("sent")
+                    logging.info(f"Telegram push to {chat_id}: {resp.status_code} {resp.text}")
+                    return
+                if resp.status_code == 429:
+                    try:
+                        delay = float(resp.json()["parameters"]["retry_after"])
+                    except (ValueError, KeyError, TypeError):
+                        delay = self._backoff(attempt)
+                elif resp.status_code >= 500:
+                    delay = self._backoff(attempt)
+                else:
+                    # 4xx（chat 不存在、token 无效等）重试无意义
+                    self._incr("failed")
+                    logging.error(f"Telegram push to {chat_id}: {resp.status_code} {resp.text}")
+                    return
+                reason = f"{resp.status_code} {resp.text}"
+
+            if attempt == self.max_retries:
+                break
+            self._incr("retries")
+            logging.warning(f"Telegram push to {chat_id} 失败: {reason}, {delay:.1f}s 后第 {attempt + 1} 次重试")
+            time.sleep(delay)
+
+        self._incr("failed")
+        logging.error(f"Telegram push to {chat_id} 重试 {self.max_retries} 次仍失败, 状态: {self.stats()}")
+
+    @staticmethod
+    def _backoff(attempt):
+        return min(2 ** attempt, 60) * random.uniform(0.5, 1)
+
+    def close(self, timeout=10):
+        """退出前等待队列中的消息发送完成，最多等待 timeout 秒"""
+        deadline = time.time() + timeout
+        while self.queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.1)
+        logging.info(f"Telegram 发送状态: {self.stats()}")
+        self.session.close()
+
+
+class ScaledObjectCache(object):
+    """
+    ScaledObject 本地缓存（informer 方式）：
+    后台线程 list 一次后持续 watch scaledobjects，维护 (命名空间, so 名称) -> {触发器类型: 触发器名称} 索引，
+    处理扩缩容事件时直接查内存，不再每个事件 GET 一次 API
+    namespace 为 None 时 list/watch 全集群的 scaledobjects
+    """
+
+    GROUP, VERSION, PLURAL = "keda.sh", "v1alpha1", "scaledobjects"
+
+    def __init__(self, api_client, namespace, watch_timeout=300):
+        self.crd_client = client.CustomObjectsApi(api_client)
+        self.namespace = namespace
+        self.watch_timeout = watch_timeout
+        # (namespace, so_name) -> [(trigger_type, trigger_name), ...]，保持 spec 中的顺序
+        self.triggers = {}
+        # (namespace, so_name) -> {trigger_type: trigger_name}，同类型取第一个
+        self.index = {}
+        self.label = namespace or "*"
+        self.lock = threading.Lock()
+        self.synced = threading.Event()
+        self.thread = None
+
+    def _api_kwargs(self, namespace=None):
+        kwargs = dict(group=self.GROUP, version=self.VERSION, plural=self.PLURAL)
+        if namespace or self.namespace:
+            kwargs["namespace"] = namespace or self.namespace
+        return kwargs
+
+    def _list_func(self):
+        if self.namespace:
+            return self.crd_client.list_namespaced_custom_object
+        return self.crd_client.list_cluster_custom_object
+
+    @staticmethod
+    def _key(so):
+        return so["metadata"].get("namespace"), so["metadata"]["name"]
+
+    def _store(self, so):
+        name = self._key(so)
+        triggers = [(t.get("type") or "", t.get("name")) for t in so.get("spec", {}).get("triggers") or []]
+        index = {}
+        for trigger_type, trigger_name in triggers:
+            index.setdefault(trigger_type, trigger_name)
+        with self.lock:
+            self.triggers[name] = triggers
+            self.index[name] = index
+
+    def _remove(self, so):
+        name = self._key(so)
+        with self.lock:
+            self.triggers.pop(name, None)
+            self.index.pop(name, None)
+
+    def relist(self):
+        """全量 list 并替换缓存，返回 resourceVersion"""
+        result = self._list_func()(**self._api_kwargs())
+        with self.lock:
+            self.triggers.clear()
+            self.index.clear()
+        for so in result.get("items", []):
+            self._store(so)
+        self.synced.set()
+        logging.info(f"[{self.label}] ScaledObject 缓存同步: {len(self.triggers)} 个")
+        return result["metadata"]["resourceVersion"]
+
+    def run(self):
+        w = watch.Watch()
+        rv = None
+        while True:
+            try:
+                if rv is None:
+                    rv = self.relist()
+                for event in w.stream(
+                    self._list_func(),
+                    resource_version=rv,
+                    allow_watch_bookmarks=True,
+                    timeout_seconds=self.watch_timeout,
+                    **self._api_kwargs(),
+                ):
+                    rv = w.resource_version or rv
+                    if event["type"] in ("ADDED", "MODIFIED"):
+                        self._store(event["object"])
+                    elif event["type"] == "DELETED":
+                        self._remove(event["object"])
+            except ApiException as e:
+                if e.status == 410:
+                    logging.warning(f"[{self.label}] ScaledObject resourceVersion {rv} 过期，重新 list")
+                    rv = None
+                    continue
+                logging.error(f"[{self.label}] ScaledObject watch 异常: status={e.status}, body={e.body}")
+                time.sleep(5)
+            except Exception as e:
+                logging.error(f"[{self.label}] ScaledObject watch 未知异常: {e}", exc_info=True)
+                time.sleep(5)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=f"so-cache-{self.label}", daemon=True)
+        self.thread.start()
+        return self
+
+    def lookup(self, namespace, so_name, scale_type):
+        """
+        按扩缩容类型查找触发器，返回 (触发器名称, 触发器类型)，找不到返回 None
+        类型精确匹配走索引，否则沿用子串匹配（外部指标类型取自 metric 名称）
+        """
+        if not self.synced.wait(timeout=10):
+            logging.warning(f"[{self.label}] ScaledObject 缓存未同步完成")
+        key = (namespace, so_name)
+        with self.lock:
+            index = self.index.get(key)
+            triggers = self.triggers.get(key)
+        if index is None:
+            # 缓存未命中（新建的 so 尚未 watch 到），回退查询一次
+            logging.info(f"[{namespace}] ScaledObject {so_name} 不在缓存中，直接查询")
+            try:
+                self._store(self.crd_client.get_namespaced_custom_object(
+                    name=so_name, **self._api_kwargs(namespace)))
+            except ApiException as e:
+                logging.warning(f"[{namespace}] 查询 ScaledObject {so_name} 失败: status={e.status}")
+                return None
+            with self.lock:
+                index = self.index.get(key)
+                triggers = self.triggers.get(key)
+
+        if scale_type in index:
+            return index[scale_type], scale_type
+        for trigger_type, trigger_name in triggers:
+            if scale_type in trigger_type:
+                return trigger_name, trigger_type
+        return None
+
+
 class K8sEventWatch(object):
-    def __init__(self, api_server, token, ns, tg_bots=None, kubeconfig=None):
+    def __init__(self, api_server, token, ns, tg_bots=None, kubeconfig=None, field_selector=DEFAULT_FIELD_SELECTOR,
+                 tg_queue_size=1000, tg_workers=2):
         """
         初始化 Kubernetes 客户端工具类
         :param api_server: Kubernetes API 地址
-        :param ns: 要操作的命名空间列表
+        :param ns: 要监听的命名空间，逗号分隔的字符串或列表；"*" 表示全部命名空间
         :param token: Bearer Token
+        :param field_selector: 事件 fieldSelector，为空则不过滤
+        :param tg_queue_size: Telegram 发送队列长度，满了丢弃
+        :param tg_workers: Telegram 发送线程数
         """
         self.api_server = api_server
         self.token = token
-        self.namespace = ns
+        if isinstance(ns, str):
+            ns = [_.strip() for _ in ns.split(",") if _.strip()]
+        self.namespaces = list(ns or [])
+        # 全部命名空间：一个 list_event_for_all_namespaces 流 + 一个全集群 ScaledObject 缓存
+        self.all_namespaces = "*" in self.namespaces
         self.regx = re.compile(
             r"^New size:\s*(\d+);\s+reason:\s+(?:(cpu|memory)|external metric (s\d+[-\w]*)).*\)(.*)"
         )
         self.tg_bots = tg_bots
-        self.msg_queue = []
+        self.tg_sender = TelegramSender(tg_bots, tg_queue_size, tg_workers) if tg_bots else None
         self.kubeconfig = kubeconfig
+        self.field_selector = field_selector or None
+        self.list_limit = 100
+        self.watch_timeout = 300
         self.client = self.get_client()
+        self.so_caches = {}
+        self.so_caches_lock = threading.Lock()
 
     def get_client(self):
         """
@@ -47,20 +307,29 @@ class K8sEventWatch(object):
             configuration.verify_ssl = False
             configuration.api_key = {"authorization": "Bearer " + self.token}
             logging.info("使用 Token + ApiServer 认证")
-            return client.ApiClient(configuration=configuration)
+            return client.ApiClient(configuration=self.pool_config(configuration))
 
         if self.kubeconfig:
             logging.info(f"使用 kubeconfig 文件: {self.kubeconfig}")
             config.load_kube_config(config_file=self.kubeconfig)
-            return client.ApiClient()
+            return client.ApiClient(configuration=self.pool_config(client.Configuration.get_default_copy()))
 
         try:
             logging.info("未提供 token 或 kubeconfig，尝试使用 InCluster 配置")
             config.load_incluster_config()
-            return client.ApiClient()
+            return client.ApiClient(configuration=self.pool_config(client.Configuration.get_default_copy()))
         except Exception as e:
             raise RuntimeError("无法初始化 Kubernetes Client") from e
 
+    def pool_config(self, configuration):
+        """
+        所有 watch 共用一个 ApiClient 连接池，每个命名空间常驻 事件 + ScaledObject 两个长连接，
+        另留余量给缓存未命中时的查询
+        """
+        streams = 2 if self.all_namespaces else 2 * len(self.namespaces)
+        configuration.connection_pool_maxsize = max(configuration.connection_pool_maxsize or 0, streams + 4)
+        return configuration
+
     def get_core_v1_client(self):
         """获取 CoreV1Api 客户端用于 Node 等操作"""
         return client.CoreV1Api(self.client)
@@ -69,6 +338,17 @@ class K8sEventWatch(object):
         """获取 CustomObjectsApi 客户端用于 CRD 操作"""
         return client.CustomObjectsApi(self.client)
 
+    def get_so_cache(self, namespace):
+        """获取命名空间的 ScaledObject 缓存，首次访问时启动 list+watch；全部命名空间模式下共用一个全集群缓存"""
+        if self.all_namespaces:
+            namespace = None
+        with self.so_caches_lock:
+            cache = self.so_caches.get(namespace)
+            if cache is None:
+                cache = ScaledObjectCache(self.client, namespace, self.watch_timeout).start()
+                self.so_caches[namespace] = cache
+        return cache
+
     @staticmethod
     def time_format(ts):
         """
@@ -78,34 +358,81 @@ class K8sEventWatch(object):
         # return ts.astimezone(timezone(timedelta(hours=8))).strftime("%Y-%m-%d %H:%M:%S")
         return ts.astimezone(ZoneInfo("Asia/Shanghai")).strftime("%Y-%m-%d %H:%M:%S")
 
+    def list_resource_version(self, list_func, **kwargs):
+        """
+        list 一次只为拿到快照 resourceVersion：
+        带 limit 分页，首页的 metadata.resourceVersion 即整个快照的版本，后续页(_continue)无需再拉取
+        """
+        events = list_func(field_selector=self.field_selector, limit=self.list_limit, **kwargs)
+        return events.metadata.resource_version
+
     def watch_namespace_events(self):  # pyright: ignore[reportUnreachable]
-        if not self.namespace:
+        """
+        监听入口：
+        - 全部命名空间: 单个 list_event_for_all_namespaces 流
+        - 多个命名空间: 每个命名空间一个 watch 线程，共用 ApiClient 连接池
+        """
+        if not self.namespaces:
             logging.error("未指定命名空间，无法监听事件")
             raise ValueError("未指定命名空间，无法监听事件")
 
+        if self.all_namespaces:
+            self.get_so_cache(None)
+            return self.watch_events(None)
+        if len(self.namespaces) == 1:
+            self.get_so_cache(self.namespaces[0])
+            return self.watch_events(self.namespaces[0])
+
+        threads = []
+        for namespace in self.namespaces:
+            self.get_so_cache(namespace)
+            t = threading.Thread(target=self.watch_events, args=(namespace,), name=f"events-{namespace}", daemon=True)
+            t.start()
+            threads.append(t)
+        # watch 线程内部循环不退出，join 带超时以便主线程响应 KeyboardInterrupt
+        while any(t.is_alive() for t in threads):
+            for t in threads:
+                t.join(timeout=1)
+
+    def watch_events(self, namespace):
+        """监听单个命名空间的事件，namespace 为 None 时监听全部命名空间"""
         v1 = self.get_core_v1_client()
-        
+        if namespace:
+            list_func, ns_kwargs = v1.list_namespaced_event, {"namespace": namespace}
+        else:
+            list_func, ns_kwargs = v1.list_event_for_all_namespaces, {}
+        label = namespace or "*"
+
         w = watch.Watch()
 
-        logging.info("监听")
+        logging.info(f"[{label}] 监听, fieldSelector: {self.field_selector or '-'}")
 
+        # rv 跨重连保留，watch 超时/断开后从上次位置续接；只有 410 过期时才重新 list
+        rv = None
         while True:
-            events = v1.list_namespaced_event(namespace=self.namespace)
-            rv = events.metadata.resource_version
             try:
+                if rv is None:
+                    rv = self.list_resource_version(list_func, **ns_kwargs)
+                    logging.info(f"[{label}] list 获取 resourceVersion: {rv}")
                 for event in w.stream(
-                    v1.list_namespaced_event,
-                    namespace=self.namespace,
+                    list_func,
+                    field_selector=self.field_selector,
                     resource_version=rv,
-                    timeout_seconds=300,
+                    allow_watch_bookmarks=True,
+                    timeout_seconds=self.watch_timeout,
+                    **ns_kwargs,
                 ):
+                    # BOOKMARK 只携带最新 resourceVersion，避免过滤后长时间无事件导致 rv 过旧
+                    rv = w.resource_version or rv
+                    if event["type"] == "BOOKMARK":
+                        continue
+
                     obj = event["object"]
                     e_type = obj.type
                     reason = obj.reason
                     involved = obj.involved_object
                     res_kind = involved.kind
                     res_name = involved.name
-                    rv = obj.metadata.resource_version
 
                     if (
                         res_kind == "HorizontalPodAutoscaler"
@@ -114,28 +441,28 @@ class K8sEventWatch(object):
                     ):
                         logging.info("=" * 30)
                         self.get_scale_reason(
-                            res_name, obj.message, timestamp=obj.last_timestamp
+                            res_name, obj.message, namespace=obj.metadata.namespace, timestamp=obj.last_timestamp
                         )
             except ApiException as e:
                 if e.status == 410:
-                    logging.warning("resourceVersion 过期，重新 list 一次")
-                    rv = v1.list_namespaced_event(
-                        namespace=self.namespace
-                    ).metadata.resource_version
+                    logging.warning(f"[{label}] resourceVersion {rv} 过期，重新 list 一次")
+                    rv = None
                     continue
                 else:
                     logging.error(
-                        f"ApiException 捕获: status={e.status}, body={e.body}"
+                        f"[{label}] ApiException 捕获: status={e.status}, body={e.body}"
                     )
                     time.sleep(5)
 
             except Exception as e:
-                logging.error(f"未知异常: {e}", exc_info=True)
+                logging.error(f"[{label}] 未知异常: {e}", exc_info=True)
                 time.sleep(5)
 
     def get_scale_reason(self, hpa_name, reason_msg, **kwargs):
         so_name = hpa_name.replace("keda-hpa-", "")
-        crd_client = self.get_crd_client()
+        namespace = kwargs.get("namespace")
+        # 多个 watch 线程并发处理事件，消息按事件单独收集
+        msgs = []
 
         result = self.regx.match(reason_msg)
         if result:
@@ -148,64 +475,40 @@ class K8sEventWatch(object):
 
             reason = reason.strip()
             if reason in "above target":
-                self.msg_queue.append("[扩容事件]")
+                msgs.append("[扩容事件]")
             else:
-                self.msg_queue.append("[缩容事件]")
-
-            so = crd_client.get_namespaced_custom_object(
-                group="keda.sh",
-                version="v1alpha1",
-                namespace=self.namespace,
-                plural="scaledobjects",
-                name=so_name,
-            )
-            triggers = so["spec"]["triggers"]
-            for trigger in triggers:
-                name = trigger.get("name")
-                trigger_type = trigger.get("type")
-
-                if scale_type in trigger_type:
-                    self.add_msg(f"so: {so_name}")
-                    self.add_msg(f"触发器: {name}")
-                    self.add_msg(f"触发器类型: {trigger_type}")
-                    self.add_msg(
-                        f"原因: {name} {reason}, autoscale replicas to: {reps}"
-                    )
-                    self.add_msg(f'时间: {self.time_format(kwargs.get("timestamp"))}')
-                    break
+                msgs.append("[缩容事件]")
+
+            trigger = self.get_so_cache(namespace).lookup(namespace, so_name, scale_type)
+            if trigger:
+                name, trigger_type = trigger
+                if len(self.namespaces) > 1 or self.all_namespaces:
+                    self.add_msg(msgs, f"命名空间: {namespace}")
+                self.add_msg(msgs, f"so: {so_name}")
+                self.add_msg(msgs, f"触发器: {name}")
+                self.add_msg(msgs, f"触发器类型: {trigger_type}")
+                self.add_msg(
+                    msgs, f"原因: {name} {reason}, autoscale replicas to: {reps}"
+                )
+                self.add_msg(msgs, f'时间: {self.time_format(kwargs.get("timestamp"))}')
         else:
             logging.warning(f"无法匹配: {reason_msg}")
 
-        self.send_tg_msg("\n".join(self.msg_queue))
-        self.msg_queue.clear()
+        self.send_tg_msg("\n".join(msgs))
 
     def send_tg_msg(self, msg):
-        if not self.tg_bots:
+        """放入发送队列后立即返回，不阻塞 watch 循环"""
+        if not self.tg_sender:
             return
         if not msg:
             return
 
-        with requests.Session() as session:
-            for bot in self.tg_bots:
-                bot_token = bot["bot_token"]
-                for chat_id in bot["chat_ids"]:
-                    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-                    payload = {"chat_id": int(chat_id), "text": msg}
-                    try:
-                        resp = session.post(url, data=payload)
-                        resp_text = resp.text
-                        logging.info(
-                            f"Telegram push to {chat_id}: {resp.status_code} {resp_text}"
-                        )
-                    except Exception as e:
-                        logging.error(
-                            f"Failed to send Telegram alert to {chat_id}: {e}",
-                            exc_info=True,
-                        )
+        self.tg_sender.send(msg)
 
-    def add_msg(self, msg):
+    @staticmethod
+    def add_msg(msgs, msg):
         logging.info(msg)
-        self.msg_queue.append(msg)
+        msgs.append(msg)
 
 
 if __name__ == "__main__":
@@ -219,6 +522,7 @@ if __name__ == "__main__":
     if RUN_ENV == "prod":
         api_srv = os.getenv("API_SRV")
         api_token = os.getenv("API_TOKEN")
+        # 逗号分隔多个命名空间，"*" 监听全部命名空间
         namespaces = os.getenv("NS", "")
     else:
         api_srv = ""
@@ -228,6 +532,10 @@ if __name__ == "__main__":
     tg_token = os.getenv(
         "TG_TOKEN", ""
     )
+    # 未设置时使用默认过滤；设置为空字符串则不过滤
+    field_selector = os.getenv("FIELD_SELECTOR", DEFAULT_FIELD_SELECTOR)
+    tg_queue_size = int(os.getenv("TG_QUEUE_SIZE", "1000"))
+    tg_workers = int(os.getenv("TG_WORKERS", "2"))
 
     tg_bots = [
         {"bot_token": tk, "chat_ids": list(map(int, ids_str.split(",")))}
@@ -235,10 +543,14 @@ if __name__ == "__main__":
     ]
 
     args_check()
-    k8s_tools = K8sEventWatch(api_srv, api_token, namespaces, tg_bots)
+    k8s_tools = K8sEventWatch(api_srv, api_token, namespaces, tg_bots, field_selector=field_selector,
+                              tg_queue_size=tg_queue_size, tg_workers=tg_workers)
     try:
         k8s_tools.watch_namespace_events()
     except KeyboardInterrupt:
         pass
     except Exception as e:
         logging.error(e, exc_info=True)
+    finally:
+        if k8s_tools.tg_sender:
+            k8s_tools.tg_sender.close()
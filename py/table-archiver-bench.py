@@ -0,0 +1,202 @@
+import argparse
+import importlib.util
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, text
+
+# table-archiver.py 文件名带 '-'，按路径加载
+_spec = importlib.util.spec_from_file_location(
+    "table_archiver", os.path.join(os.path.dirname(os.path.abspath(__file__)), "table-archiver.py"))
+archiver = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(archiver)
+
+SRC = "bench_src"
+SEED = "bench_seed"
+
+
+class ArchiveBench:
+    """归档基准测试：生成合成源表/归档表，按 模式 x 批大小 x 索引 矩阵运行 ArchiveManager 并输出 JSON"""
+
+    def __init__(self, engine, rows=100000, row_width=200, json_cols=2, density=1.0, overlap=0.0, seed=42):
+        self.engine = engine
+        self.rows = rows
+        self.row_width = row_width
+        self.json_cols = json_cols
+        self.density = density
+        self.overlap = overlap
+        self.seed = seed
+        self.logger = logging.getLogger("archiver")
+        self.base_time = datetime(2024, 1, 1)
+
+    def table_ddl(self, table):
+        virtual_cols = "".join(
+            f"k{i} VARCHAR(64) GENERATED ALWAYS AS (JSON_UNQUOTE(JSON_EXTRACT(ext, '$.k{i}'))) VIRTUAL,\n"
+            for i in range(self.json_cols))
+        return f"""
+            CREATE TABLE {table} (
+                id BIGINT NOT NULL,
+                create_time DATETIME NOT NULL,
+                status INT NOT NULL,
+                payload VARCHAR({max(self.row_width, 1)}) NOT NULL,
+                ext JSON,
+                {virtual_cols}PRIMARY KEY (id),
+                KEY idx_create_time (create_time)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+
+    @property
+    def physical_fields(self):
+        return "id,create_time,status,payload,ext"
+
+    def execute(self, *sqls):
+        with self.engine.begin() as conn:
+            for sql in sqls:
+                conn.execute(text(sql))
+
+    def generate(self):
+        """生成种子表，之后每轮测试从种子表复制，保证各轮数据一致"""
+        rnd = random.Random(self.seed)
+        self.execute(f"DROP TABLE IF EXISTS {SEED}", f"DROP TABLE IF EXISTS {SEED}_history",
+                     self.table_ddl(SEED), self.table_ddl(f"{SEED}_history"))
+
+        insert_sql = text(f"INSERT INTO {SEED} ({self.physical_fields}) "
+                          f"VALUES (:id, :create_time, :status, :payload, :ext)")
+        chunk = []
+        _t = time.time()
+        with self.engine.begin() as conn:
+            for i in range(self.rows):
+                # density<1 时id之间留空洞
+                row_id = int(i / self.density) + 1
+                ext = {f"k{k}": f"v{rnd.randint(0, 999)}" for k in range(self.json_cols)}
+                chunk.append({
+                    "id": row_id,
+                    "create_time": self.base_time + timedelta(seconds=i),
+                    "status": rnd.randint(0, 9),
+                    "payload": "x" * self.row_width,
+                    "ext": json.dumps(ext),
+                })
+                if len(chunk) >= 5000:
+                    conn.execute(insert_sql, chunk)
+                    chunk = []
+            if chunk:
+                conn.execute(insert_sql, chunk)
+
+            # 预先归档一部分，模拟重跑/部分已归档
+            if self.overlap > 0:
+                conn.execute(text(f"""
+                    INSERT INTO {SEED}_history ({self.physical_fields})
+                    SELECT {self.physical_fields} FROM {SEED} WHERE id % 10000 < :pct
+                """), {"pct": int(self.overlap * 10000)})
+        self.logger.info(f"生成种子数据 {self.rows} 行, 耗时 {time.time() - _t:.1f}s")
+
+    def reset(self):
+        self.execute(
+            f"DROP TABLE IF EXISTS {SRC}", f"DROP TABLE IF EXISTS {SRC}_history",
+            f"CREATE TABLE {SRC} LIKE {SEED}", f"CREATE TABLE {SRC}_history LIKE {SEED}_history",
+            f"INSERT INTO {SRC} ({self.physical_fields}) SELECT {self.physical_fields} FROM {SEED}",
+            f"INSERT INTO {SRC}_history ({self.physical_fields}) SELECT {self.physical_fields} FROM {SEED}_history",
+        )
+
+    def where_clause(self, fraction):
+        cutoff = self.base_time + timedelta(seconds=int(self.rows * fraction))
+        return f"create_time < '{cutoff:%Y-%m-%d %H:%M:%S}'"
+
+    def run_case(self, mode, batch, idxs, where_clause, do_delete, workers, prefetch):
+        self.reset()
+        metrics = archiver.ArchiveMetrics()
+        manager = archiver.ArchiveManager(self.engine, check_mode=mode, idxs=idxs, batch_size=batch,
+                                          do_delete=do_delete, workers=workers, prefetch=prefetch,
+                                          metrics=metrics)
+        _t = time.time()
+        summary = manager.archive_table(SRC, f"{SRC}_history", where_clause) or {}
+        elapsed = time.time() - _t
+        phases = {}
+        for phase, h in metrics.tables.get(SRC, {}).get("phases", {}).items():
+            if h.count:
+                phases[phase] = {"count": h.count, "sum_ms": h.sum, "p50_ms": round(h.quantile(0.5), 1),
+                                 "p95_ms": round(h.quantile(0.95), 1), "p99_ms": round(h.quantile(0.99), 1)}
+        return {
+            "mode": mode, "batch": batch, "idxs": idxs, "do_delete": do_delete, "workers": workers,
+            "prefetch": prefetch, "elapsed_s": round(elapsed, 3),
+            "rows_per_sec": round(summary.get("queried", 0) / elapsed, 1) if elapsed else 0,
+            "summary": summary, "phases": phases,
+        }
+
+    def run(self, modes, batches, idxs_list, fraction=1.0, do_delete=False, workers=1, prefetch=0, repeat=1):
+        where_clause = self.where_clause(fraction)
+        results = []
+        for mode, batch, idxs, n in itertools.product(modes, batches, idxs_list, range(repeat)):
+            self.logger.info(f"{'-' * 20} 模式={mode} 批大小={batch} 索引={idxs or '-'} 第{n + 1}轮 {'-' * 20}")
+            results.append(self.run_case(mode, batch, idxs, where_clause, do_delete, workers, prefetch))
+        return {
+            "dataset": {"rows": self.rows, "row_width": self.row_width, "json_cols": self.json_cols,
+                        "density": self.density, "overlap": self.overlap, "fraction": fraction},
+            "results": results,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="table-archiver 基准测试 (需本地 MySQL，会创建/删除 bench_* 表)")
+    parser.add_argument("-u", required=True, help="user")
+    parser.add_argument("-p", required=False, help="password")
+    parser.add_argument("-ip", default="127.0.0.1", help="host (默认 127.0.0.1)")
+    parser.add_argument("-P", required=False, help="port")
+    parser.add_argument("-d", required=True, help="数据库")
+    parser.add_argument("--rows", type=int, default=100000, help="源表行数 (默认 100000)")
+    parser.add_argument("--row-width", type=int, default=200, help="payload 字段字节数 (默认 200)")
+    parser.add_argument("--json-cols", type=int, default=2, help="JSON 虚拟列个数 (默认 2)")
+    parser.add_argument("--density", type=float, default=1.0, help="id 密度 (0,1]，<1 时id有空洞 (默认 1)")
+    parser.add_argument("--overlap", type=float, default=0.0, help="预先已归档的比例 [0,1] (默认 0)")
+    parser.add_argument("--fraction", type=float, default=1.0, help="归档条件覆盖的行比例 (默认 1)")
+    parser.add_argument("--modes", default="in,join", help="校验模式列表，逗号分隔 (默认 in,join)")
+    parser.add_argument("--batches", default="1000", help="批大小列表，逗号分隔 (默认 1000)")
+    parser.add_argument("--idxs", action="append", default=None,
+                        help="索引提示，格式同 table-archiver -idxs (如 bench_src=idx_create_time)，可多次指定")
+    parser.add_argument("--delete", action="store_true", help="归档后删除源表数据")
+    parser.add_argument("--workers", type=int, default=1, help="分片并发线程数 (默认 1)")
+    parser.add_argument("--prefetch", type=int, default=0, help="预取队列深度 (默认 0)")
+    parser.add_argument("--repeat", type=int, default=1, help="每组重复次数 (默认 1)")
+    parser.add_argument("--skip-generate", action="store_true", help="复用已有种子表")
+    parser.add_argument("-o", "--output", help="结果 JSON 文件，默认输出到 stdout")
+    parser.add_argument("--debug", action="store_true", help="输出详细日志")
+    args = parser.parse_args()
+
+    # run_time 装饰器使用模块级 logger
+    archiver.logger = archiver.setup_logger("bench.log", args.debug)
+
+    db = f'mysql+pymysql://{args.u}:{args.p}@{args.ip}:{args.P if args.P else 3306}/{args.d}?charset=utf8mb4&use_unicode=True'
+    engine = create_engine(db, pool_recycle=3600, pool_size=max(5, args.workers * 2))
+
+    bench = ArchiveBench(engine, args.rows, args.row_width, args.json_cols, args.density, args.overlap)
+    if not args.skip_generate:
+        bench.generate()
+    report = bench.run(
+        modes=[m.strip() for m in args.modes.split(",")],
+        batches=[int(b) for b in args.batches.split(",")],
+        idxs_list=args.idxs or [""],
+        fraction=args.fraction, do_delete=args.delete, workers=args.workers, prefetch=args.prefetch,
+        repeat=args.repeat,
+    )
+    out = json.dumps(report, ensure_ascii=False, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(out)
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(1)
+
+    ## 示例
+    #python3 table-archiver-bench.py -u root -p 123456 -d test --rows 500000 --modes in,join,range --batches 500,2000,5000 --overlap 0.1 --delete -o bench.json
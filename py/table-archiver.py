@@ -1,11 +1,39 @@
 import argparse
+import bisect
+import cProfile
+import csv
+import gzip
+import hashlib
+import http.server
+import io
+import json
 import logging
+import os
+import pstats
+import queue
+import random
+import re
 import sys
+import tempfile
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from functools import wraps
 
-from sqlalchemy import create_engine, text, inspect
+from sqlalchemy import bindparam, create_engine, event, text, inspect
+
+# 文件归档的可选依赖：parquet 需要 pyarrow，zstd 压缩需要 zstandard
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 def run_time(func):
@@ -22,12 +50,32 @@ def run_time(func):
 
 
 # ========== 日志配置 ==========
+# 线程级日志前缀，如 [w1] ，并发归档时区分各线程输出
+_log_ctx = threading.local()
+
+
+class LogContextFilter(logging.Filter):
+    def filter(self, record):
+        record.ctx = getattr(_log_ctx, "prefix", "")
+        return True
+
+
+def run_with_log_prefix(prefix, func, *args, **kwargs):
+    """在线程内设置日志前缀后执行 func"""
+    _log_ctx.prefix = prefix
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _log_ctx.prefix = ""
+
+
 def setup_logger(logfile="archive.log", debug=False):
     log = logging.getLogger("archiver")
     log.setLevel(logging.DEBUG if debug else logging.INFO)
     if not log.handlers:
+        log.addFilter(LogContextFilter())
         fh = logging.FileHandler(logfile, encoding="utf-8")
-        fmt = logging.Formatter("[%(asctime)s] %(levelname)s: %(message)s")
+        fmt = logging.Formatter("[%(asctime)s] %(levelname)s: %(ctx)s%(message)s")
         fh.setFormatter(fmt)
         log.addHandler(fh)
         sh = logging.StreamHandler(sys.stdout)
@@ -36,12 +84,1279 @@ def setup_logger(logfile="archive.log", debug=False):
     return log
 
 
+class ProgressEstimator:
+    """
+    进度/ETA 估算，避免全量 COUNT：以 EXPLAIN 估算行数为初值，按游标已覆盖的id跨度比例
+    与实际行密度（已处理行数/已覆盖跨度）修正总行数，覆盖越多越信任实测值
+    """
+
+    def __init__(self, estimate_rows, ranges, start_id=None, every=10):
+        self.estimate_rows = estimate_rows or 0
+        self.every = every
+        self.lock = threading.Lock()
+        self.spans = {}
+        for range_no, last_id, end_id in ranges:
+            lo = last_id if last_id is not None else (start_id - 1 if isinstance(start_id, int) else None)
+            if isinstance(lo, int) and isinstance(end_id, int):
+                self.spans[range_no] = (lo, end_id)
+        # 只有所有区间都是整数跨度时才能按覆盖比例估算
+        if len(self.spans) != len(ranges):
+            self.spans = {}
+        self.cursors = {}
+        self.rows = 0
+        self.batches = 0
+        self.started = time.time()
+
+    def coverage(self):
+        total = sum(hi - lo for lo, hi in self.spans.values())
+        if not total:
+            return None
+        covered = sum(min(self.cursors.get(no, lo), hi) - lo for no, (lo, hi) in self.spans.items())
+        return covered / total
+
+    def estimated_total(self, coverage):
+        if not coverage:
+            return max(self.estimate_rows, self.rows)
+        observed = self.rows / coverage
+        if not self.estimate_rows:
+            return observed
+        weight = min(1.0, coverage * 5)
+        return max(weight * observed + (1 - weight) * self.estimate_rows, self.rows)
+
+    def update(self, range_no, cursor, n_rows):
+        """记录一批进度，每 every 批返回一条进度描述，否则返回 None"""
+        with self.lock:
+            self.rows += n_rows
+            self.batches += 1
+            if cursor is not None:
+                self.cursors[range_no] = cursor
+            if self.every <= 0 or self.batches % self.every:
+                return None
+            return self.describe()
+
+    def finish(self, range_no):
+        with self.lock:
+            if range_no in self.spans:
+                self.cursors[range_no] = self.spans[range_no][1]
+
+    def describe(self):
+        coverage = self.coverage()
+        total = self.estimated_total(coverage)
+        elapsed = max(time.time() - self.started, 1e-3)
+        rate = self.rows / elapsed
+        pct = self.rows / total if total else 0
+        eta = timedelta(seconds=int((total - self.rows) / rate)) if rate and total else "未知"
+        cov = f", id覆盖 {coverage:.1%}" if coverage is not None else ""
+        return f"进度: {pct:.1%} ({self.rows}/~{int(total)} 行{cov}), {rate:.0f} 行/s, 预计剩余 {eta}"
+
+
+class ArchiveProgress:
+    """单表归档进度汇总，多个分片线程共享"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.estimator = None
+        self.total_queried = 0
+        self.total_archived = 0
+        self.total_deleted = 0
+        self.batches = 0
+        self.throttle_ms = 0
+        # 到达截止时间提前结束，区间未完成
+        self.expired = False
+
+    def add(self, n_sel, n_ins, n_del, batches=1):
+        """累加一批结果，返回 (总归档, 总删除)"""
+        with self.lock:
+            self.total_queried += n_sel
+            self.total_archived += n_ins
+            self.total_deleted += n_del
+            self.batches += batches
+            return self.total_archived, self.total_deleted
+
+    def add_throttle(self, ms):
+        with self.lock:
+            self.throttle_ms += ms
+
+    def summary(self):
+        with self.lock:
+            return {
+                "queried": self.total_queried,
+                "archived": self.total_archived,
+                "deleted": self.total_deleted,
+                "batches": self.batches,
+                "throttle_ms": self.throttle_ms,
+                "expired": self.expired,
+            }
+
+
+class AdaptiveBatchSizer:
+    """
+    自适应批大小：根据每批实测阶段耗时 (t_sel+t_chk+t_ins+t_del) 估算单行耗时，
+    调整批大小逼近目标批次耗时，单次最多放大/缩小2倍，并限制在 [min_size, max_size]
+    target_ms<=0 时固定批大小
+    """
+
+    def __init__(self, size, target_ms=0, min_size=100, max_size=50000, logger=None):
+        self.target_ms = target_ms
+        self.min_size = min_size
+        self.max_size = max_size
+        self.size = max(min_size, min(size, max_size)) if target_ms > 0 else size
+        self.logger = logger or logging.getLogger("archiver")
+        self.ms_per_row = None
+
+    def update(self, batch_ms, n_rows):
+        """按本批耗时调整下一批大小，返回新的批大小"""
+        if self.target_ms <= 0 or n_rows <= 0:
+            return self.size
+        sample = max(batch_ms, 1) / n_rows
+        # 指数平滑，避免单批抖动导致来回调整
+        self.ms_per_row = sample if self.ms_per_row is None else 0.7 * self.ms_per_row + 0.3 * sample
+        # 尾批行数不足时只更新估算，不调整
+        if n_rows < self.size:
+            return self.size
+
+        ideal = int(self.target_ms / self.ms_per_row)
+        new_size = max(self.size // 2, min(ideal, self.size * 2))
+        new_size = max(self.min_size, min(new_size, self.max_size))
+        # 变化小于10%不调整
+        if abs(new_size - self.size) * 10 >= self.size:
+            self.logger.info(f"批大小调整: {self.size} -> {new_size} (本批 {batch_ms} ms/{n_rows} 行, "
+                             f"目标 {self.target_ms} ms)")
+            self.size = new_size
+        return self.size
+
+
+class ArchiveThrottler:
+    """
+    批次间限流：轮询主库 Threads_running、从库复制延迟，并限制每秒归档行数，
+    超过阈值时退避等待直到恢复。同一管理器下的所有表/分片线程共享
+    """
+
+    def __init__(self, engine, max_threads_running=0, replica_engines=None, max_lag=0, max_rows_per_sec=0,
+                 check_interval=1.0, max_backoff=30.0, logger=None):
+        self.engine = engine
+        self.max_threads_running = max_threads_running
+        self.replica_engines = replica_engines or []
+        self.max_lag = max_lag
+        self.max_rows_per_sec = max_rows_per_sec
+        self.check_interval = check_interval
+        self.max_backoff = max_backoff
+        self.logger = logger or logging.getLogger("archiver")
+        self.lock = threading.Lock()
+        self.last_check = 0
+        self.last_reason = None
+        self.rate_until = 0
+
+    @property
+    def enabled(self):
+        return bool(self.max_threads_running or (self.replica_engines and self.max_lag) or self.max_rows_per_sec)
+
+    @staticmethod
+    def query_threads_running(engine):
+        with engine.connect() as conn:
+            row = conn.execute(text("SHOW GLOBAL STATUS LIKE 'Threads_running'")).fetchone()
+        return int(row[1]) if row else 0
+
+    @staticmethod
+    def query_replica_lag(engine):
+        """返回从库延迟秒数，复制未运行返回 None"""
+        with engine.connect() as conn:
+            try:
+                row = conn.execute(text("SHOW REPLICA STATUS")).mappings().fetchone()
+            except Exception:
+                # MySQL 8.0.22 以下 / MariaDB 旧版本
+                row = conn.execute(text("SHOW SLAVE STATUS")).mappings().fetchone()
+        if not row:
+            return None
+        lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+        return int(lag) if lag is not None else None
+
+    def check(self):
+        """检查负载信号，返回超限原因，未超限返回 None"""
+        if self.max_threads_running:
+            running = self.query_threads_running(self.engine)
+            if running > self.max_threads_running:
+                return f"Threads_running={running} > {self.max_threads_running}"
+        if self.max_lag:
+            for replica in self.replica_engines:
+                lag = self.query_replica_lag(replica)
+                if lag is None:
+                    return f"从库 {replica.url.host}:{replica.url.port} 复制未运行"
+                if lag > self.max_lag:
+                    return f"从库 {replica.url.host}:{replica.url.port} 延迟 {lag}s > {self.max_lag}s"
+        return None
+
+    def _poll(self, force=False):
+        # 多线程共享同一次检查结果，check_interval 内不重复查询
+        with self.lock:
+            if force or time.time() - self.last_check >= self.check_interval:
+                try:
+                    self.last_reason = self.check()
+                except Exception as e:
+                    # 检查失败（如从库不可达）按超限处理，退避后重试
+                    self.last_reason = f"负载检查失败: {e}"
+                self.last_check = time.time()
+            return self.last_reason
+
+    def wait(self, n_rows, stop_event=None):
+        """批次结束后调用，必要时休眠，返回限流耗时ms"""
+        if not self.enabled:
+            return 0
+        _tt = time.time()
+
+        # 1. 行速率上限：按已消耗的行数预约时间片，允许1秒突发
+        if self.max_rows_per_sec and n_rows:
+            with self.lock:
+                now = time.time()
+                self.rate_until = max(self.rate_until, now - 1) + n_rows / self.max_rows_per_sec
+                delay = self.rate_until - now
+            if delay > 0:
+                if stop_event:
+                    stop_event.wait(delay)
+                else:
+                    time.sleep(delay)
+
+        # 2. 负载/延迟信号：超限时指数退避，直到恢复
+        backoff = 0.5
+        reason = self._poll()
+        while reason and not (stop_event and stop_event.is_set()):
+            self.logger.warning(f"限流: {reason}, 等待 {backoff:.1f}s")
+            if stop_event:
+                stop_event.wait(backoff)
+            else:
+                time.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+            reason = self._poll(force=True)
+
+        return int((time.time() - _tt) * 1000)
+
+
+class BatchPrefetcher:
+    """
+    后台线程预取主键批次：用已取到批次的最后一个id继续查下一批，放入有界队列，
+    与消费线程的插入/删除事务流水线并行，隐藏查询id的耗时
+    """
+
+    def __init__(self, manager, source_table, where_clause, last_id, end_id, sizer, depth, stop_event):
+        self.manager = manager
+        self.source_table = source_table
+        self.where_clause = where_clause
+        self.last_id = last_id
+        self.end_id = end_id
+        self.sizer = sizer
+        self.queue = queue.Queue(maxsize=depth)
+        self.stop_event = stop_event
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=run_with_log_prefix,
+                                       args=(getattr(_log_ctx, "prefix", ""), self._run),
+                                       name="archiver-prefetch", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _put(self, item):
+        while not (self.closed.is_set() or self.stop_event.is_set()):
+            try:
+                self.queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _finish(self, item):
+        """
+        结束时必须交给消费者一个终止项（空批次或异常），不受 stop_event 影响，
+        否则消费者会一直阻塞在 get；消费者已 close 时无需再放
+        """
+        while not self.closed.is_set():
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _run(self):
+        last_id = self.last_id
+        terminal = []
+        try:
+            with self.manager.engine.connect() as conn:
+                while True:
+                    id_list, t_sel = self.manager.fetch_batch_ids(conn, self.source_table, self.where_clause,
+                                                                  last_id, self.end_id, self.sizer.size)
+                    # 每次查询后结束事务，避免长时间持有一致性快照
+                    conn.rollback()
+                    self.manager.logger.debug(f"预取: {t_sel} ms, 行数 {len(id_list)}")
+                    if not id_list:
+                        break
+                    if not self._put(id_list):
+                        return
+                    last_id = id_list[-1]
+        except Exception as e:
+            terminal = e
+        finally:
+            self._finish(terminal)
+
+    def get(self):
+        """取下一批id，返回 (id_list, 等待耗时ms)，等待耗时即流水线未能隐藏的查询时间"""
+        _ts = time.time()
+        while True:
+            try:
+                item = self.queue.get(timeout=1)
+                break
+            except queue.Empty:
+                # 兜底：预取线程已退出且没有留下终止项
+                if not self.thread.is_alive() and self.queue.empty():
+                    raise Exception("预取线程已退出")
+        if isinstance(item, Exception):
+            raise item
+        return item, int((time.time() - _ts) * 1000)
+
+    def close(self):
+        self.closed.set()
+        self.thread.join()
+
+
+class CheckpointStore:
+    """
+    归档断点存储：按 (源表, 目标表, 条件) 记录每个分片区间的 end_id 与最后提交的 last_id，
+    --resume 时从断点继续，不再重新计算首尾ID和扫描已处理区间
+    """
+
+    @staticmethod
+    def job_key(source_table, dest_table, where_clause):
+        return hashlib.md5(f"{source_table}|{dest_table}|{where_clause}".encode("utf-8")).hexdigest()
+
+    def load(self, source_table, dest_table, where_clause):
+        """返回 [{'range_no', 'end_id', 'last_id', 'done'}, ...]，无断点返回空列表"""
+        raise NotImplementedError
+
+    @staticmethod
+    def key_value(value):
+        """多列游标键以 JSON 数组存储，读回时还原为 tuple"""
+        return tuple(value) if isinstance(value, list) else value
+
+    def save(self, source_table, dest_table, where_clause, range_no, end_id, last_id, done=False):
+        raise NotImplementedError
+
+    def clear(self, source_table, dest_table, where_clause):
+        raise NotImplementedError
+
+    def bind(self, source_table, dest_table, where_clause, range_no, end_id):
+        """绑定到单个分片区间，返回 save(last_id, done=False) 回调"""
+        def save(last_id, done=False):
+            self.save(source_table, dest_table, where_clause, range_no, end_id, last_id, done)
+
+        return save
+
+
+class FileCheckpointStore(CheckpointStore):
+    """本地 JSON 文件断点，每次先写临时文件再原子替换"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write(self, data):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def load(self, source_table, dest_table, where_clause):
+        with self.lock:
+            job = self._read().get(self.job_key(source_table, dest_table, where_clause))
+        if not job:
+            return []
+        return [dict(r, end_id=self.key_value(r["end_id"]), last_id=self.key_value(r["last_id"]))
+                for r in sorted(job["ranges"].values(), key=lambda r: r["range_no"])]
+
+    def save(self, source_table, dest_table, where_clause, range_no, end_id, last_id, done=False):
+        key = self.job_key(source_table, dest_table, where_clause)
+        with self.lock:
+            data = self._read()
+            job = data.setdefault(key, {"source_table": source_table, "dest_table": dest_table,
+                                        "where_clause": where_clause, "ranges": {}})
+            job["ranges"][str(range_no)] = {"range_no": range_no, "end_id": end_id, "last_id": last_id,
+                                            "done": done, "updated_at": datetime.now().isoformat()}
+            self._write(data)
+
+    def clear(self, source_table, dest_table, where_clause):
+        with self.lock:
+            data = self._read()
+            if data.pop(self.job_key(source_table, dest_table, where_clause), None) is not None:
+                self._write(data)
+
+
+class TableCheckpointStore(CheckpointStore):
+    """目标库中的断点表，id 以 JSON 编码存储以保留整数/字符串类型"""
+
+    def __init__(self, engine, table="archive_checkpoint"):
+        self.engine = engine
+        self.table = table
+        with self.engine.begin() as conn:
+            conn.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    job_key CHAR(32) NOT NULL,
+                    range_no INT NOT NULL,
+                    source_table VARCHAR(128) NOT NULL,
+                    dest_table VARCHAR(128) NOT NULL,
+                    where_clause TEXT,
+                    end_id VARCHAR(255),
+                    last_id VARCHAR(255),
+                    done TINYINT NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    PRIMARY KEY (job_key, range_no)
+                ) DEFAULT CHARSET=utf8mb4
+            """))
+
+    def load(self, source_table, dest_table, where_clause):
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(f"""
+                SELECT range_no, end_id, last_id, done FROM {self.table}
+                WHERE job_key = :job_key ORDER BY range_no
+            """), {"job_key": self.job_key(source_table, dest_table, where_clause)}).fetchall()
+        return [{"range_no": r[0], "end_id": self.key_value(json.loads(r[1])),
+                 "last_id": self.key_value(json.loads(r[2])), "done": bool(r[3])} for r in rows]
+
+    def save(self, source_table, dest_table, where_clause, range_no, end_id, last_id, done=False):
+        with self.engine.begin() as conn:
+            conn.execute(text(f"""
+                INSERT INTO {self.table} (job_key, range_no, source_table, dest_table, where_clause, end_id, last_id, done)
+                VALUES (:job_key, :range_no, :source_table, :dest_table, :where_clause, :end_id, :last_id, :done)
+                ON DUPLICATE KEY UPDATE last_id = VALUES(last_id), done = VALUES(done)
+            """), {"job_key": self.job_key(source_table, dest_table, where_clause), "range_no": range_no,
+                   "source_table": source_table, "dest_table": dest_table, "where_clause": where_clause,
+                   "end_id": json.dumps(end_id, default=str), "last_id": json.dumps(last_id, default=str),
+                   "done": int(done)})
+
+    def clear(self, source_table, dest_table, where_clause):
+        with self.engine.begin() as conn:
+            conn.execute(text(f"DELETE FROM {self.table} WHERE job_key = :job_key"),
+                         {"job_key": self.job_key(source_table, dest_table, where_clause)})
+
+
+class FileArchiveSink:
+    """
+    文件归档目标：每批行以流式游标读出，写入按行数轮转的压缩文件，
+    支持 parquet、jsonl、csv (gzip/zstd)，目录下 manifest.jsonl 记录每个文件的id区间与行数
+    """
+    FORMATS = ("jsonl", "csv", "parquet")
+    COMPRESSIONS = ("gzip", "zstd", "none")
+
+    def __init__(self, directory, fmt="jsonl", compression="gzip", rotate_rows=1000000):
+        if fmt not in self.FORMATS:
+            raise ValueError(f"不支持的文件格式: {fmt}")
+        if compression not in self.COMPRESSIONS:
+            raise ValueError(f"不支持的压缩方式: {compression}")
+        if fmt == "parquet" and pa is None:
+            raise RuntimeError("parquet 格式需要安装 pyarrow")
+        if fmt != "parquet" and compression == "zstd" and zstandard is None:
+            raise RuntimeError("zstd 压缩需要安装 zstandard")
+        self.directory = directory
+        self.fmt = fmt
+        self.compression = compression
+        self.rotate_rows = rotate_rows
+        self.manifest_path = os.path.join(directory, "manifest.jsonl")
+        self.manifest_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def ext(self):
+        if self.fmt == "parquet":
+            return "parquet"
+        return {"gzip": f"{self.fmt}.gz", "zstd": f"{self.fmt}.zst", "none": self.fmt}[self.compression]
+
+    def open_writer(self, source_table, range_no, last_id, column_types=None):
+        """column_types: {列名: information_schema COLUMN_TYPE}，parquet 按列类型建 schema"""
+        return FileArchiveWriter(self, source_table, range_no, last_id, column_types)
+
+    def append_manifest(self, entry):
+        with self.manifest_lock:
+            with open(self.manifest_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+class FileArchiveWriter:
+    """
+    单个分片的文件写入器。源表删除只在文件关闭并 fsync 之后进行，
+    durable_id 为已落盘的最大游标id，断点只推进到该位置
+    """
+
+    def __init__(self, sink, source_table, range_no, last_id, column_types=None):
+        self.sink = sink
+        self.column_types = column_types or {}
+        self.source_table = source_table
+        self.range_no = range_no
+        self.durable_id = last_id
+        # 带上 pid，同一秒内重启不会复用并截断上次遗留的 .part 文件
+        self.run_ts = f"{datetime.now():%Y%m%d%H%M%S}_{os.getpid()}"
+        self.seq = 0
+        self._reset()
+
+    def _reset(self):
+        self.raw = None
+        self.fh = None
+        self.writer = None
+        self.path = None
+        self.columns = None
+        self.rows = 0
+        self.pending_ids = []
+
+    def _open(self, columns):
+        self.seq += 1
+        table_dir = os.path.join(self.sink.directory, self.source_table)
+        os.makedirs(table_dir, exist_ok=True)
+        self.path = os.path.join(
+            table_dir, f"{self.source_table}_{self.run_ts}_w{self.range_no}_{self.seq:05d}.{self.sink.ext}")
+        self.columns = list(columns)
+        self.raw = open(f"{self.path}.part", "wb")
+        if self.sink.fmt == "parquet":
+            return
+        if self.sink.compression == "gzip":
+            stream = gzip.GzipFile(fileobj=self.raw, mode="wb")
+        elif self.sink.compression == "zstd":
+            stream = zstandard.ZstdCompressor().stream_writer(self.raw, closefd=False)
+        else:
+            stream = self.raw
+        self.fh = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+        if self.sink.fmt == "csv":
+            self.writer = csv.writer(self.fh)
+            self.writer.writerow(self.columns)
+
+    @staticmethod
+    def arrow_type(column_type):
+        """
+        MySQL COLUMN_TYPE 映射为 Arrow 类型。schema 必须来自列定义而不是数据推断：
+        按首批数据推断时 DECIMAL 精度取自首批的值、BLOB 可能被推断成 string，后续批次写入即失败
+        无法识别的类型返回 None，按字符串写入
+        """
+        t = (column_type or "").lower()
+        m = re.match(r"(\w+)(?:\((\d+)(?:,\s*(\d+))?\))?", t)
+        if not m:
+            return None
+        base, p1, p2 = m.group(1), m.group(2), m.group(3)
+        unsigned = "unsigned" in t
+        ints = {"tinyint": 8, "smallint": 16, "mediumint": 32, "int": 32, "integer": 32, "bigint": 64}
+        if base in ints:
+            bits = ints[base]
+            return getattr(pa, f"{'u' if unsigned else ''}int{bits}")()
+        if base in ("decimal", "numeric"):
+            precision, scale = int(p1 or 10), int(p2 or 0)
+            return pa.decimal128(precision, scale) if precision <= 38 else pa.decimal256(precision, scale)
+        if base == "float":
+            return pa.float32()
+        if base in ("double", "real"):
+            return pa.float64()
+        if base in ("char", "varchar", "tinytext", "text", "mediumtext", "longtext", "enum", "set", "json"):
+            return pa.string()
+        if base in ("binary", "varbinary", "tinyblob", "blob", "mediumblob", "longblob", "bit") or \
+                base in ("geometry", "point", "linestring", "polygon"):
+            return pa.binary()
+        if base == "date":
+            return pa.date32()
+        if base in ("datetime", "timestamp"):
+            return pa.timestamp("us")
+        if base == "time":
+            return pa.duration("us")
+        if base == "year":
+            return pa.int16()
+        return None
+
+    def _parquet_schema(self):
+        return pa.schema([pa.field(c, self.arrow_type(self.column_types.get(c)) or pa.string())
+                          for c in self.columns])
+
+    def _write_parquet(self, rows):
+        if self.writer is None:
+            compression = None if self.sink.compression == "none" else self.sink.compression
+            self.writer = pq.ParquetWriter(self.raw, self._parquet_schema(), compression=compression)
+            self.convert = []
+            for i, field in enumerate(self.writer.schema):
+                if pa.types.is_string(field.type) and self.arrow_type(self.column_types.get(field.name)) is None:
+                    # 未识别的类型按字符串写入
+                    self.convert.append((i, lambda v: v.decode("utf-8", "replace") if isinstance(v, bytes) else str(v)))
+                elif pa.types.is_date(field.type) or pa.types.is_timestamp(field.type):
+                    # 非严格模式下的零值日期 PyMySQL 返回字符串，无法表示为日期，写为 NULL
+                    self.convert.append((i, lambda v: None if isinstance(v, str) else v))
+        if self.convert:
+            rows = [list(row) for row in rows]
+            for row in rows:
+                for i, conv in self.convert:
+                    if row[i] is not None:
+                        row[i] = conv(row[i])
+        columns = list(zip(*rows))
+        table = pa.Table.from_arrays(
+            [pa.array(col, type=field.type) for col, field in zip(columns, self.writer.schema)],
+            schema=self.writer.schema)
+        self.writer.write_table(table)
+
+    def write_rows(self, columns, rows, id_index):
+        """写入一批行（可迭代，流式消费），返回写入行数；多列键时 id_index 为位置元组"""
+        if isinstance(id_index, tuple):
+            def key_of(row):
+                return tuple(row[i] for i in id_index)
+        else:
+            def key_of(row):
+                return row[id_index]
+        if self.raw is None:
+            self._open(columns)
+        n = 0
+        if self.sink.fmt == "parquet":
+            buf = []
+            for row in rows:
+                buf.append(tuple(row))
+                self.pending_ids.append(key_of(row))
+                n += 1
+                if len(buf) >= 10000:
+                    self._write_parquet(buf)
+                    buf = []
+            if buf:
+                self._write_parquet(buf)
+        else:
+            for row in rows:
+                if self.sink.fmt == "csv":
+                    self.writer.writerow(row)
+                else:
+                    self.fh.write(json.dumps(dict(zip(self.columns, row)), ensure_ascii=False, default=str) + "\n")
+                self.pending_ids.append(key_of(row))
+                n += 1
+        self.rows += n
+        return n
+
+    def should_rotate(self):
+        return self.rows >= self.sink.rotate_rows
+
+    def rotate(self, last_id):
+        """关闭并 fsync 当前文件，写 manifest，返回需要从源表删除的id列表"""
+        ids = self.pending_ids
+        if self.raw is not None:
+            if self.sink.fmt == "parquet":
+                if self.writer is not None:
+                    self.writer.close()
+            else:
+                self.fh.flush()
+                if self.fh.buffer is self.raw:
+                    self.fh.detach()
+                else:
+                    self.fh.close()
+            self.raw.flush()
+            os.fsync(self.raw.fileno())
+            self.raw.close()
+            os.replace(f"{self.path}.part", self.path)
+            # 目录项也需要落盘，保证 rename 持久化
+            dir_fd = os.open(os.path.dirname(self.path), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+            if self.rows:
+                self.sink.append_manifest({
+                    "file": os.path.relpath(self.path, self.sink.directory), "source_table": self.source_table,
+                    "first_id": ids[0] if ids else None, "last_id": ids[-1] if ids else None, "rows": self.rows,
+                    "format": self.sink.fmt, "compression": self.sink.compression,
+                    "created_at": datetime.now().isoformat(),
+                })
+        self.durable_id = last_id
+        self._reset()
+        return ids
+
+    def abort(self):
+        """出错时保留 .part 文件，不删除源表数据"""
+        if self.raw is not None:
+            if not self.raw.closed:
+                self.raw.close()
+            logging.getLogger("archiver").warning(
+                f"{self.source_table} 分片{self.range_no} 中止, 未完成文件保留: {self.path}.part ({self.rows} 行, 源表未删除)")
+        self._reset()
+
+
+def mysql_errno(e):
+    """从 SQLAlchemy/PyMySQL 异常中取 MySQL 错误码，取不到返回 None"""
+    orig = getattr(e, "orig", e)
+    args = getattr(orig, "args", None)
+    if args and isinstance(args[0], int):
+        return args[0]
+    return None
+
+
+class PhaseHistogram:
+    """固定分桶的耗时直方图(ms)，分位数按桶内线性插值估算（同 Prometheus histogram_quantile）"""
+    BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(self.BUCKETS, ms)] += 1
+        self.sum += ms
+        self.count += 1
+
+    def quantile(self, q):
+        if not self.count:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = self.BUCKETS[i - 1] if i > 0 else 0
+                if i == len(self.BUCKETS):
+                    return lower
+                return lower + (self.BUCKETS[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.BUCKETS[-1]
+
+
+class ArchiveMetrics:
+    """
+    归档指标：各阶段耗时直方图、行数计数、按时间窗口的行速率、锁等待/死锁次数，
+    可导出 Prometheus 文本格式（HTTP 端点或 textfile collector 文件）
+    """
+    PHASES = ("select", "check", "insert", "delete", "batch", "throttle")
+    RATE_WINDOW = 10
+
+    def __init__(self, textfile=None, textfile_interval=15):
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.textfile = textfile
+        self.textfile_interval = textfile_interval
+        self.last_write = 0
+        # 多个分片/表线程共用同一个 textfile，判断间隔、渲染、替换需串行（render 内部会取 self.lock）
+        self.write_lock = threading.Lock()
+
+    def _table(self, table):
+        if table not in self.tables:
+            self.tables[table] = {
+                "phases": {p: PhaseHistogram() for p in self.PHASES},
+                "rows": {"queried": 0, "archived": 0, "deleted": 0},
+                "errors": {"lock_wait": 0, "deadlock": 0, "other": 0},
+                "window_start": time.time(), "window_rows": 0,
+                "rates": deque(maxlen=360),
+                "server": {},
+            }
+        return self.tables[table]
+
+    def observe_batch(self, table, t_sel, t_chk, t_ins, t_del, elapsed_ms, n_sel, n_ins, n_del):
+        with self.lock:
+            m = self._table(table)
+            for phase, ms in zip(("select", "check", "insert", "delete", "batch"),
+                                 (t_sel, t_chk, t_ins, t_del, elapsed_ms)):
+                m["phases"][phase].observe(ms)
+            m["rows"]["queried"] += n_sel
+            m["rows"]["archived"] += n_ins
+            m["rows"]["deleted"] += n_del
+            m["window_rows"] += n_sel
+            now = time.time()
+            if now - m["window_start"] >= self.RATE_WINDOW:
+                m["rates"].append((now, m["window_rows"] / (now - m["window_start"])))
+                m["window_start"], m["window_rows"] = now, 0
+        self.maybe_write_textfile()
+
+    def observe_throttle(self, table, ms):
+        with self.lock:
+            self._table(table)["phases"]["throttle"].observe(ms)
+
+    def observe_error(self, table, e):
+        errno = mysql_errno(e)
+        kind = {1205: "lock_wait", 1213: "deadlock"}.get(errno, "other")
+        with self.lock:
+            self._table(table)["errors"][kind] += 1
+
+    def set_server_stats(self, table, stats):
+        """记录本表归档期间服务端全局锁等待的增量（包含业务连接）"""
+        with self.lock:
+            self._table(table)["server"] = dict(stats)
+
+    def summary_lines(self, table):
+        with self.lock:
+            m = self._table(table)
+            lines = []
+            for phase in self.PHASES:
+                h = m["phases"][phase]
+                if h.count:
+                    lines.append(f"  {phase:<8} n={h.count} p50={h.quantile(0.5):.0f}ms p95={h.quantile(0.95):.0f}ms "
+                                 f"p99={h.quantile(0.99):.0f}ms sum={h.sum}ms")
+            rates = [r for _, r in m["rates"]]
+            if rates:
+                lines.append(f"  行速率(每{self.RATE_WINDOW}s窗口): min={min(rates):.0f} avg={sum(rates) / len(rates):.0f} "
+                             f"max={max(rates):.0f} 行/s")
+            errors = m["errors"]
+            lines.append(f"  锁等待超时 {errors['lock_wait']} 次, 死锁 {errors['deadlock']} 次, 其他错误 {errors['other']} 次")
+            if m["server"]:
+                lines.append("  服务端增量: " + ", ".join(f"{k}={v}" for k, v in m["server"].items()))
+            return lines
+
+    def render(self):
+        """Prometheus 文本格式"""
+        out = [
+            "# HELP archiver_phase_duration_ms Archive batch phase duration in milliseconds.",
+            "# TYPE archiver_phase_duration_ms histogram",
+        ]
+        with self.lock:
+            for table, m in self.tables.items():
+                for phase, h in m["phases"].items():
+                    labels = f'table="{table}",phase="{phase}"'
+                    cumulative = 0
+                    for le, n in zip(PhaseHistogram.BUCKETS, h.counts):
+                        cumulative += n
+                        out.append(f'archiver_phase_duration_ms_bucket{{{labels},le="{le}"}} {cumulative}')
+                    out.append(f'archiver_phase_duration_ms_bucket{{{labels},le="+Inf"}} {h.count}')
+                    out.append(f"archiver_phase_duration_ms_sum{{{labels}}} {h.sum}")
+                    out.append(f"archiver_phase_duration_ms_count{{{labels}}} {h.count}")
+            out += ["# HELP archiver_rows_total Rows processed by the archiver.",
+                    "# TYPE archiver_rows_total counter"]
+            for table, m in self.tables.items():
+                for op, n in m["rows"].items():
+                    out.append(f'archiver_rows_total{{table="{table}",op="{op}"}} {n}')
+            out += ["# HELP archiver_rows_per_second Rows per second over the last window.",
+                    "# TYPE archiver_rows_per_second gauge"]
+            for table, m in self.tables.items():
+                rate = m["rates"][-1][1] if m["rates"] else 0
+                out.append(f'archiver_rows_per_second{{table="{table}"}} {rate:.2f}')
+            out += ["# HELP archiver_errors_total Batch errors by kind (lock_wait=1205, deadlock=1213).",
+                    "# TYPE archiver_errors_total counter"]
+            for table, m in self.tables.items():
+                for kind, n in m["errors"].items():
+                    out.append(f'archiver_errors_total{{table="{table}",kind="{kind}"}} {n}')
+            out += ["# HELP archiver_server_status_delta Server-wide status counter delta during the table run.",
+                    "# TYPE archiver_server_status_delta gauge"]
+            for table, m in self.tables.items():
+                for name, v in m["server"].items():
+                    out.append(f'archiver_server_status_delta{{table="{table}",name="{name}"}} {v}')
+        return "\n".join(out) + "\n"
+
+    def maybe_write_textfile(self, force=False):
+        if not self.textfile:
+            return
+        with self.write_lock:
+            if not force and time.time() - self.last_write < self.textfile_interval:
+                return
+            self.last_write = time.time()
+            # textfile collector 要求原子替换
+            tmp = f"{self.textfile}.{os.getpid()}.tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(self.render())
+                os.replace(tmp, self.textfile)
+            except OSError as e:
+                # 指标导出失败不影响归档，批次此时已提交
+                logging.getLogger("archiver").warning(f"写入指标文件 {self.textfile} 失败: {e}")
+
+    def serve(self, port, host="0.0.0.0"):
+        """后台线程提供 /metrics HTTP 端点"""
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="archiver-metrics", daemon=True).start()
+        return server
+
+
+class TableKey:
+    """
+    归档游标键：主键或非空唯一索引的列。单列时游标值为标量，SQL 与断点格式和原来的 id 游标一致；
+    多列时游标值为 tuple，用行构造器 (a, b) > (:a, :b) 做 keyset 分页，IN 列表写成 ((:a, :b), ...)，
+    每批都是该索引上的范围扫描
+    """
+
+    def __init__(self, columns, types=None, index="PRIMARY"):
+        self.columns = tuple(columns)
+        self.types = list(types or [None] * len(self.columns))
+        # 键列上没有可用索引时为 None，不加 FORCE INDEX
+        self.index = index
+
+    def __repr__(self):
+        return f"{self.index or '-'}({', '.join(self.columns)})"
+
+    @property
+    def single(self):
+        return len(self.columns) == 1
+
+    @property
+    def hint(self):
+        return f"FORCE INDEX(`{self.index}`)" if self.index else ""
+
+    def cols(self, alias=None, desc=False):
+        """列清单，用于 SELECT / ORDER BY"""
+        prefix = f"{alias}." if alias else ""
+        suffix = " DESC" if desc else ""
+        return ", ".join(f"{prefix}{c}{suffix}" for c in self.columns)
+
+    def expr(self, alias=None):
+        return self.cols(alias) if self.single else f"({self.cols(alias)})"
+
+    def compare(self, op, name, value, params, alias=None):
+        """游标比较条件，如 id > :last_id 或 (a, b) > (:last_id_0, :last_id_1)"""
+        if self.single:
+            params[name] = value
+            return f"{self.expr(alias)} {op} :{name}"
+        params.update({f"{name}_{i}": v for i, v in enumerate(value)})
+        return f"{self.expr(alias)} {op} ({', '.join(f':{name}_{i}' for i in range(len(value)))})"
+
+    def placeholders(self, values, params, prefix="id"):
+        """值列表展开为绑定参数，返回 [':id_0', ...] 或 ['(:id_0_0, :id_0_1)', ...]"""
+        if self.single:
+            params.update({f"{prefix}_{i}": v for i, v in enumerate(values)})
+            return [f":{prefix}_{i}" for i in range(len(values))]
+        items = []
+        for i, value in enumerate(values):
+            params.update({f"{prefix}_{i}_{j}": v for j, v in enumerate(value)})
+            items.append(f"({', '.join(f':{prefix}_{i}_{j}' for j in range(len(value)))})")
+        return items
+
+    def in_list(self, values, params, prefix="id", alias=None):
+        return f"{self.expr(alias)} IN ({','.join(self.placeholders(values, params, prefix))})"
+
+    def join_on(self, left, right):
+        return " AND ".join(f"{left}.{c}={right}.{c}" for c in self.columns)
+
+    def value(self, row, offset=0):
+        """从结果行取键值，键列需在行的 offset 位置起连续排列"""
+        if self.single:
+            return row[offset]
+        return tuple(row[offset:offset + len(self.columns)])
+
+    def indexes_in(self, fields):
+        """键列在字段列表中的位置"""
+        if self.single:
+            return fields.index(self.columns[0])
+        return tuple(fields.index(c) for c in self.columns)
+
+
+class SchemaCache:
+    """
+    表结构元数据缓存：一次连接内用 information_schema 批量加载所有表的列、生成列、主键类型、索引和分区，
+    整个运行期复用；指定 cache_file 时按表结构校验和落盘，结构未变的表下次启动不再加载列/索引。
+    分区的行数和分区列表会随归档变化，每次都实时加载
+    """
+
+    CHECKSUM_SQL = """
+        SELECT c.TABLE_NAME AS table_name, MD5(CONCAT(
+            GROUP_CONCAT(CONCAT_WS(':', c.COLUMN_NAME, c.COLUMN_TYPE, c.IS_NULLABLE, c.EXTRA, c.COLUMN_KEY)
+                         ORDER BY c.ORDINAL_POSITION),
+            '|', IFNULL((SELECT GROUP_CONCAT(CONCAT_WS(':', s.INDEX_NAME, s.SEQ_IN_INDEX, s.COLUMN_NAME)
+                                              ORDER BY s.INDEX_NAME, s.SEQ_IN_INDEX)
+                         FROM information_schema.STATISTICS s
+                         WHERE s.TABLE_SCHEMA = c.TABLE_SCHEMA AND s.TABLE_NAME = c.TABLE_NAME), ''))) AS checksum
+        FROM information_schema.COLUMNS c
+        WHERE c.TABLE_SCHEMA = DATABASE() AND c.TABLE_NAME IN :names
+        GROUP BY c.TABLE_SCHEMA, c.TABLE_NAME
+    """
+    COLUMNS_SQL = """
+        SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, EXTRA, COLUMN_KEY, IS_NULLABLE
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN :names
+        ORDER BY TABLE_NAME, ORDINAL_POSITION
+    """
+    INDEXES_SQL = """
+        SELECT TABLE_NAME, INDEX_NAME, COLUMN_NAME, NON_UNIQUE
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN :names
+        ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX
+    """
+    PARTITIONS_SQL = """
+        SELECT TABLE_NAME, PARTITION_NAME, PARTITION_METHOD, PARTITION_EXPRESSION, PARTITION_DESCRIPTION,
+               TABLE_ROWS, SUBPARTITION_NAME
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN :names AND PARTITION_NAME IS NOT NULL
+        ORDER BY TABLE_NAME, PARTITION_ORDINAL_POSITION, SUBPARTITION_ORDINAL_POSITION
+    """
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.logger = logging.getLogger("archiver")
+        self.disk = {}
+        if cache_file and os.path.exists(cache_file):
+            try:
+                with open(cache_file, encoding="utf-8") as f:
+                    self.disk = json.load(f)
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"表结构缓存文件 {cache_file} 读取失败，忽略: {e}")
+
+    @staticmethod
+    def engine_key(engine):
+        return engine.url.render_as_string(hide_password=True)
+
+    def _query(self, conn, sql, names):
+        stmt = text(sql).bindparams(bindparam("names", expanding=True))
+        return conn.execute(stmt, {"names": names}).mappings().all()
+
+    def load(self, engine, tables):
+        """一次连接内批量加载多张表的元数据，已缓存的表跳过"""
+        key = self.engine_key(engine)
+        with self.lock:
+            names = sorted({t for t in tables if (key, t) not in self.tables})
+            if not names:
+                return
+            _t = time.time()
+            loaded = {}
+            with engine.connect() as conn:
+                missing = names
+                if self.cache_file:
+                    conn.execute(text("SET SESSION group_concat_max_len = 1048576"))
+                    checksums = {r["table_name"]: r["checksum"] for r in self._query(conn, self.CHECKSUM_SQL, names)}
+                    disk = self.disk.get(key, {})
+                    missing = []
+                    for name in names:
+                        cached = disk.get(name)
+                        if cached and name in checksums and cached["checksum"] == checksums[name]:
+                            loaded[name] = dict(cached)
+                        else:
+                            missing.append(name)
+                    if missing:
+                        self.logger.debug(f"表结构缓存未命中: {missing}")
+                else:
+                    checksums = {}
+
+                if missing:
+                    for row in self._query(conn, self.COLUMNS_SQL, missing):
+                        meta = loaded.setdefault(row["TABLE_NAME"], {
+                            "checksum": checksums.get(row["TABLE_NAME"]), "columns": [], "indexes": {},
+                            "unique": []})
+                        meta["columns"].append({
+                            "field": row["COLUMN_NAME"], "type": row["COLUMN_TYPE"],
+                            "extra": (row["EXTRA"] or "").lower(), "key": row["COLUMN_KEY"],
+                            "nullable": row["IS_NULLABLE"] == "YES",
+                        })
+                    for row in self._query(conn, self.INDEXES_SQL, missing):
+                        meta = loaded.get(row["TABLE_NAME"])
+                        if meta is None:
+                            continue
+                        meta["indexes"].setdefault(row["INDEX_NAME"], []).append(row["COLUMN_NAME"])
+                        if not int(row["NON_UNIQUE"]) and row["INDEX_NAME"] not in meta["unique"]:
+                            meta["unique"].append(row["INDEX_NAME"])
+
+                partitions = {}
+                for row in self._query(conn, self.PARTITIONS_SQL, names):
+                    partitions.setdefault(row["TABLE_NAME"], []).append({
+                        "name": row["PARTITION_NAME"], "method": row["PARTITION_METHOD"],
+                        "expression": row["PARTITION_EXPRESSION"], "description": row["PARTITION_DESCRIPTION"],
+                        "rows": row["TABLE_ROWS"], "subpartition": row["SUBPARTITION_NAME"],
+                    })
+
+            for name, meta in loaded.items():
+                meta["partitions"] = partitions.get(name, [])
+                self.tables[(key, name)] = meta
+            self.logger.debug(f"加载表结构 {names}, 耗时 {(time.time() - _t) * 1000:.0f} ms")
+            if self.cache_file and missing:
+                self.save_disk(key, {n: m for n, m in loaded.items() if n in missing})
+
+    def save_disk(self, key, loaded):
+        disk = self.disk.setdefault(key, {})
+        for name, meta in loaded.items():
+            disk[name] = {k: v for k, v in meta.items() if k != "partitions"}
+        tmp = f"{self.cache_file}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.disk, f, ensure_ascii=False)
+            os.replace(tmp, self.cache_file)
+        except OSError as e:
+            self.logger.warning(f"表结构缓存文件 {self.cache_file} 写入失败: {e}")
+
+    def get(self, engine, table):
+        """返回表元数据，不存在返回 None"""
+        key = self.engine_key(engine)
+        if (key, table) not in self.tables:
+            self.load(engine, [table])
+        return self.tables.get((key, table))
+
+
+class ArchiveProfiler:
+    """
+    --profile 性能剖析，结束时输出:
+    - <prefix>.pstats: cProfile 结果，覆盖所有线程。Python 3.12+ 的 cProfile 基于 sys.monitoring，
+      同一时间只允许一个 Profile 且本身对所有线程生效；更早版本每个新线程各自启用一个 Profile，结束时合并
+    - <prefix>.collapsed: 后台线程用 sys._current_frames 定时采样各线程调用栈，折叠栈格式，
+      可直接用 flamegraph.pl / speedscope 生成火焰图
+    - <prefix>.sql.tsv: 按语句模板统计客户端耗时（text() 编译、参数处理）与 cursor.execute 耗时
+      （网络+服务端执行+PyMySQL 读取解码结果）
+    mode=sample 时只采样不启用 cProfile，开销更小
+    """
+
+    def __init__(self, prefix, mode="both", interval=0.005, logger=None):
+        self.prefix = prefix
+        self.mode = mode
+        self.interval = interval
+        self.logger = logger or logging.getLogger("archiver")
+        self.lock = threading.Lock()
+        self.profiles = []
+        self.stacks = {}
+        self.samples = 0
+        self.sql = {}
+        self.stop_event = threading.Event()
+        self.sampler = None
+        self.per_thread = sys.version_info < (3, 12)
+
+    # ---- cProfile (<3.12): 新线程首次触发 profile 回调时为该线程启用独立 Profile
+    def _thread_hook(self, *args):
+        sys.setprofile(None)
+        prof = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(prof)
+        prof.enable()
+
+    # ---- 采样
+    @staticmethod
+    def _frame_label(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_label(frame))
+                    frame = frame.f_back
+                # 线程池线程名带序号，按前缀归并
+                name = re.sub(r"_\d+$", "", names.get(ident, str(ident)))
+                key = ";".join([name] + stack[::-1])
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    # ---- SQL 客户端/服务端耗时
+    @staticmethod
+    def _statement_key(statement):
+        sql = re.sub(r"\s+", " ", statement).strip()
+        # IN 列表/VALUES 中的连续占位符合并，同一语句模板不因批大小不同而分散；
+        # 占位符含 format (%s)、pyformat (%(id_1_1)s，PyMySQL 展开 IN 参数时使用) 与 qmark (?)。
+        # 不截断：长语句截断后占位符列表被切在不同位置，同一模板会得到不同的键
+        p = r"(?:%s|%\(\w+\)s|\?)"
+        return re.sub(rf"\(?{p}\)?(?:\s*,\s*\(?{p}(?:\s*,\s*{p})*\)?)+", "…", sql)
+
+    def attach(self, engine):
+        @event.listens_for(engine, "before_execute")
+        def before_execute(conn, clauseelement, multiparams, params, execution_options):
+            conn.info.setdefault("profile_t", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info["profile_cursor_t"] = time.perf_counter()
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            now = time.perf_counter()
+            starts = conn.info.get("profile_t")
+            t_cursor = conn.info.pop("profile_cursor_t", now)
+            # 不经过 Connection.execute 的语句（如连接池 ping）没有客户端阶段
+            client = (t_cursor - starts[-1]) if starts else 0.0
+            key = self._statement_key(statement)
+            with self.lock:
+                stat = self.sql.setdefault(key, [0, 0.0, 0.0, 0.0])
+                stat[0] += 1
+                stat[1] += client
+                stat[2] += now - t_cursor
+            conn.info["profile_after_cursor"] = (key, now)
+
+        @event.listens_for(engine, "after_execute")
+        def after_execute(conn, clauseelement, multiparams, params, execution_options, result):
+            starts = conn.info.get("profile_t")
+            if starts:
+                starts.pop()
+            after_cursor = conn.info.pop("profile_after_cursor", None)
+            if after_cursor:
+                key, t = after_cursor
+                with self.lock:
+                    self.sql[key][3] += time.perf_counter() - t
+
+    def start(self):
+        # 采样线程先于 profile 钩子启动，不被 cProfile 覆盖
+        self.sampler = threading.Thread(target=self._sample, name="archiver-profiler", daemon=True)
+        self.sampler.start()
+        if self.mode != "sample":
+            self.main_profile = cProfile.Profile()
+            if self.per_thread:
+                threading.setprofile(self._thread_hook)
+            self.main_profile.enable()
+        self._t = time.time()
+        return self
+
+    def stop(self):
+        if self.mode != "sample":
+            self.main_profile.disable()
+            if self.per_thread:
+                threading.setprofile(None)
+        self.stop_event.set()
+        self.sampler.join()
+        self.elapsed = time.time() - self._t
+
+    def dump(self):
+        """写出剖析文件并在日志中输出摘要"""
+        self.logger.info(f"{'=' * 30} 性能剖析 {'=' * 30}")
+        if self.mode != "sample":
+            stats = pstats.Stats(self.main_profile)
+            with self.lock:
+                for prof in self.profiles:
+                    prof.create_stats()
+                    if prof.stats:
+                        stats.add(prof)
+            stats.dump_stats(f"{self.prefix}.pstats")
+            out = io.StringIO()
+            stats.stream = out
+            stats.sort_stats("tottime").print_stats(15)
+            threads = f"{len(self.profiles) + 1} 个线程" if self.per_thread else "全部线程"
+            self.logger.info(f"cProfile ({threads}) 按自身耗时 Top 15:\n{out.getvalue()}")
+
+        with open(f"{self.prefix}.collapsed", "w", encoding="utf-8") as f:
+            for key, count in sorted(self.stacks.items()):
+                f.write(f"{key} {count}\n")
+
+        rows = sorted(self.sql.items(), key=lambda kv: kv[1][1] + kv[1][2] + kv[1][3], reverse=True)
+        with open(f"{self.prefix}.sql.tsv", "w", encoding="utf-8") as f:
+            f.write("count\tclient_ms\texecute_ms\tpost_ms\tstatement\n")
+            for key, (n, client, execute, post) in rows:
+                f.write(f"{n}\t{client * 1000:.1f}\t{execute * 1000:.1f}\t{post * 1000:.1f}\t{key}\n")
+        client = sum(v[1] + v[3] for v in self.sql.values())
+        execute = sum(v[2] for v in self.sql.values())
+        self.logger.info(f"总耗时 {self.elapsed:.1f}s, SQL {sum(v[0] for v in self.sql.values())} 条: "
+                         f"客户端(编译/参数/结果封装) {client:.2f}s, cursor.execute(网络/服务端/结果读取) {execute:.2f}s")
+        for key, (n, c, e, post) in rows[:5]:
+            self.logger.info(f"  {n:>6} 次 客户端 {(c + post) * 1000:>8.0f} ms, execute {e * 1000:>8.0f} ms  {key[:120]}")
+        self.logger.info(f"采样 {self.samples} 次 (间隔 {self.interval * 1000:.0f} ms), 输出: " +
+                         ", ".join(f"{self.prefix}.{ext}" for ext in
+                                   (["pstats"] if self.mode != "sample" else []) + ["collapsed", "sql.tsv"]))
+
+
 class ArchiveManager:
     """数据归档管理器"""
 
     def __init__(self, engine, debug=False, slow_ms=0, check_mode='in', idxs='',
                  batch_size=1000, do_delete=False,
-                 check_schema=True, count_all=False, dry_run=False, analyze=False):
+                 check_schema=True, count_all=False, dry_run=False, analyze=False, workers=1, prefetch=0,
+                 target_ms=0, min_batch=100, max_batch=50000, throttler=None, checkpoint=None, resume=False,
+                 sink=None, dest_engine=None, bulk_mode="executemany", range_density=0.8, metrics=None,
+                 partition_mode=None, progress_every=10, schema=None, keys='', deadline=None,
+                 split_delete=0, lock_retries=5, lock_wait_timeout=0):
         self.engine = engine
         self.debug = debug
         self.slow_ms = slow_ms
@@ -55,6 +1370,37 @@ class ArchiveManager:
         # 默认值（可被方法参数覆盖）
         self.batch_size = batch_size
         self.do_delete = do_delete
+        self.workers = workers
+        self.prefetch = prefetch
+        # 自适应批大小，target_ms<=0 时关闭
+        self.target_ms = target_ms
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.throttler = throttler or ArchiveThrottler(engine)
+        # 断点存储，resume=True 时从断点继续
+        self.checkpoint = checkpoint
+        self.resume = resume
+        # 文件归档目标，为 None 时写入 _history 表
+        self.sink = sink
+        # 跨实例归档的目标库，为 None 时与源表同库 INSERT ... SELECT
+        self.dest_engine = dest_engine
+        self.bulk_mode = bulk_mode
+        # range 模式下 批次行数/id跨度 低于该值时回退 IN 模式
+        self.range_density = range_density
+        self.metrics = metrics or ArchiveMetrics()
+        # 分区快速路径：None(关闭) | exchange | copy
+        self.partition_mode = partition_mode
+        # 每 N 批输出一次进度/ETA，<=0 关闭
+        self.progress_every = progress_every
+        # 表结构元数据缓存，多表/多步骤共用
+        self.schema = schema or SchemaCache()
+        # 截止时间(时间戳)，到点后各分片在当前批次提交后停止，断点保留到下次继续
+        self.deadline = deadline
+        # 拆分提交：插入先提交，源表删除按 split_delete 行分段独立短事务，<=0 关闭
+        self.split_delete = split_delete
+        # 锁等待超时/死锁的重试次数，lock_wait_timeout>0 时删除事务使用该会话锁等待超时(秒)
+        self.lock_retries = lock_retries
+        self.lock_wait_timeout = lock_wait_timeout
 
         if idxs:
             self.idxs = {
@@ -64,16 +1410,26 @@ class ArchiveManager:
         else:
             self.idxs = {}
         # self.idxs = f"FORCE INDEX({idx})" if idx else ""
+        # 显式指定的游标键列，格式同 idxs: 表名=列1+列2,...
+        self.key_columns = {
+            k[0].strip(): [c.strip() for c in k[1].split('+')]
+            for k in [_.strip().split('=') for _ in keys.split(',') if _.strip()]
+        } if keys else {}
+        self.keys = {}
 
-    def run_query_sql(self, sql, params=None, fetch="all", mappings=False, scalar=False):
+    def expired(self):
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def run_query_sql(self, sql, params=None, fetch="all", mappings=False, scalar=False, engine=None):
         """
         仅执行查询 SQL，并在连接关闭前完成结果提取，避免游标在连接关闭后被读取。
         - params: 可选参数字典
+        - engine: 可选，默认源库
         - fetch: all | one | none
         - mappings: 是否返回字典风格行（依赖 .mappings()）
         - scalar: 是否返回标量（通常与 fetch=one 配合）
         """
-        with self.engine.connect() as conn:
+        with (engine or self.engine).connect() as conn:
             result = conn.execute(text(sql), params or {})
             if scalar:
                 return result.scalar_one_or_none()
@@ -82,20 +1438,22 @@ class ArchiveManager:
                     result.mappings().one_or_none() if fetch == "one" else None)
             return result.fetchall() if fetch == "all" else (result.fetchone() if fetch == "one" else None)
 
-    def get_table_fields(self, table_name):
+    def get_table_meta(self, table_name, engine=None):
+        """从结构缓存取表元数据，表不存在时报错"""
+        meta = self.schema.get(engine or self.engine, table_name)
+        if not meta:
+            raise Exception(f"表 {table_name} 不存在")
+        return meta
+
+    def get_table_fields(self, table_name, engine=None):
         """检查表结构，返回虚拟字段、物理字段和id类型"""
         virtual_json_fields = []
         physical_fields = []
         id_sql_type = None
-        sql = f"SHOW FULL COLUMNS FROM {table_name}"
-        rows = self.run_query_sql(sql, fetch="all")
-        if not rows:
-            raise Exception(f"表 {table_name} 不存在")
-
-        for row in rows:
-            field = row[0]
-            col_type = row[1]  # 完整类型，如 'bigint(20)' 或 'varchar(64)'
-            extra = row[6].lower() if row[6] else ''
+        for col in self.get_table_meta(table_name, engine)["columns"]:
+            field = col["field"]
+            col_type = col["type"]  # 完整类型，如 'bigint(20)' 或 'varchar(64)'
+            extra = col["extra"]
 
             if field == 'id':
                 id_sql_type = col_type
@@ -107,9 +1465,74 @@ class ArchiveManager:
                 physical_fields.append(field)
         return virtual_json_fields, physical_fields, id_sql_type
 
+    def get_table_partitions(self, table_name):
+        """查询分区信息，非分区表返回空列表"""
+        return self.get_table_meta(table_name)["partitions"]
+
+    def get_table_indexes(self, table_name):
+        """返回 {索引名: [列, ...]}"""
+        return self.get_table_meta(table_name)["indexes"]
+
+    @staticmethod
+    def key_index(indexes, columns):
+        """
+        键列对应的索引，用于 FORCE INDEX：优先列完全一致的索引，其次以键列为前缀的索引（同样支持按键有序范围扫描），
+        都没有返回 None
+        """
+        columns = list(columns)
+        for name, cols in indexes.items():
+            if cols == columns:
+                return name
+        return next((name for name, cols in indexes.items() if cols[:len(columns)] == columns), None)
+
+    def table_key(self, table_name):
+        """
+        游标键：--keys 指定的列 > 主键 > 第一个全部非空列的唯一索引 > id 列，结果按表缓存
+        """
+        key = self.keys.get(table_name)
+        if key:
+            return key
+        meta = self.get_table_meta(table_name)
+        types = {c["field"]: c["type"] for c in meta["columns"]}
+        nullable = {c["field"] for c in meta["columns"] if c["nullable"]}
+        columns = self.key_columns.get(table_name)
+        index = "PRIMARY"
+        if columns:
+            index = self.key_index(meta["indexes"], columns)
+            if not index:
+                self.logger.warning(f"表 {table_name} 游标列 {columns} 上没有索引，每批都可能全表扫描")
+        elif "PRIMARY" in meta["indexes"]:
+            columns = meta["indexes"]["PRIMARY"]
+        else:
+            index = next((name for name in meta["unique"]
+                          if not nullable & set(meta["indexes"][name])), None)
+            if index:
+                columns = meta["indexes"][index]
+            elif "id" in types:
+                columns = ["id"]
+                index = self.key_index(meta["indexes"], columns)
+            else:
+                raise Exception(f"表 {table_name} 没有主键或非空唯一索引，请用 --keys 指定游标列")
+        missing = [c for c in columns if c not in types]
+        if missing:
+            raise Exception(f"表 {table_name} 不存在游标列: {missing}")
+        key = TableKey(columns, [types[c] for c in columns], index)
+        self.keys[table_name] = key
+        return key
+
+    def preload_schema(self, tables, table_suffix):
+        """多表归档前一次性加载源表和目标表结构"""
+        if self.sink:
+            self.schema.load(self.engine, tables)
+        elif self.dest_engine:
+            self.schema.load(self.engine, tables)
+            self.schema.load(self.dest_engine, [f"{t}{table_suffix}" for t in tables])
+        else:
+            self.schema.load(self.engine, tables + [f"{t}{table_suffix}" for t in tables])
+
     def check_schema_compatibility(self, source_table, dest_table, physical_fields):
         """检查源表和目标表字段兼容性"""
-        _, dest_physical_fields, _ = self.get_table_fields(dest_table)
+        _, dest_physical_fields, _ = self.get_table_fields(dest_table, engine=self.dest_engine)
         src_set = set(physical_fields)
         dst_set = set(dest_physical_fields)
         all_missing = src_set ^ dst_set
@@ -130,7 +1553,7 @@ class ArchiveManager:
         """分析查询计划，检查是否全表扫描"""
 
         explain_sql = f"""
-            EXPLAIN SELECT id 
+            EXPLAIN SELECT {self.table_key(source_table).cols()}
             FROM {source_table} {self.idxs.get(source_table)}
             WHERE {where_clause}
         """
@@ -138,10 +1561,22 @@ class ArchiveManager:
         if any([True for _ in res if _ and (_.get("type") == "ALL" or not _.get('key'))]):
             self.logger.warning(f"当前条件存在全表扫描")
 
+    def estimate_total_records(self, source_table, where_clause):
+        """用 EXPLAIN 的 rows*filtered 估算待归档行数，不做全量扫描"""
+        explain_sql = f"""
+            EXPLAIN SELECT {self.table_key(source_table).cols()}
+            FROM {source_table} {self.idxs.get(source_table)}
+            WHERE {where_clause}
+        """
+        res = self.run_query_sql(explain_sql, fetch="all", mappings=True) or []
+        if not res or res[0].get("rows") is None:
+            return 0
+        return int(int(res[0]["rows"]) * float(res[0].get("filtered") or 100) / 100)
+
     def count_total_records(self, source_table, where_clause):
         """统计待归档总数"""
         count_all_sql = f"""
-            SELECT count(id) FROM {source_table} {self.idxs.get(source_table)}
+            SELECT count(*) FROM {source_table} {self.idxs.get(source_table)}
             WHERE {where_clause}
         """
         total_count = self.run_query_sql(count_all_sql, fetch="one", scalar=True) or 0
@@ -149,57 +1584,127 @@ class ArchiveManager:
         return total_count
 
     def compute_boundary_ids(self, source_table, where_clause):
-        """计算符合条件的最小/最大ID"""
-        sql = f"""
-            SELECT MIN(id) AS min_id, MAX(id) AS max_id
-            FROM {source_table} {self.idxs.get(source_table)}
-            WHERE {where_clause}
+        """计算符合条件的最小/最大ID，多列键按索引顺序取首尾行"""
+        key = self.table_key(source_table)
+        if key.single:
+            sql = f"""
+                SELECT MIN({key.cols()}) AS min_id, MAX({key.cols()}) AS max_id
+                FROM {source_table} {self.idxs.get(source_table)}
+                WHERE {where_clause}
+            """
+            row = self.run_query_sql(sql, fetch="one")
+            if not row or (row[0] is None and row[1] is None):
+                return None, None
+            return row[0], row[1]
+        bounds = []
+        for desc in (False, True):
+            row = self.run_query_sql(f"""
+                SELECT {key.cols()} FROM {source_table} {self.idxs.get(source_table)}
+                WHERE {where_clause}
+                ORDER BY {key.cols(desc=desc)}
+                LIMIT 1
+            """, fetch="one")
+            if not row:
+                return None, None
+            bounds.append(key.value(row))
+        return bounds[0], bounds[1]
+
+    @staticmethod
+    def split_id_ranges(start_id, end_id, workers):
+        """
+        将 [start_id, end_id] 按id跨度切成 workers 个互不重叠的区间 (last_id, end_id]
+        - 第一个区间 last_id 为 None，与单线程游标起点一致
+        - 仅整数主键可切分，其他类型退化为单区间
         """
-        row = self.run_query_sql(sql, fetch="one")
-        if not row or (row[0] is None and row[1] is None):
-            return None, None
-        return row[0], row[1]
+        if workers <= 1 or not isinstance(start_id, int) or not isinstance(end_id, int):
+            return [(None, end_id)]
+        span = end_id - start_id + 1
+        workers = min(workers, span)
+        step = span // workers
+        bounds = [start_id - 1 + step * i for i in range(1, workers)]
+        lows = [None] + bounds
+        highs = bounds + [end_id]
+        return list(zip(lows, highs))
 
     def query_batch_ids(self, source_table, where_clause, last_id, end_id, batch_size):
         """查询一批主键ID（增加上限 end_id）"""
+        key = self.table_key(source_table)
         conds = [where_clause]
         params = {}
 
         if last_id is not None:
-            conds.append("id > :last_id")
-            params["last_id"] = last_id
+            conds.append(key.compare(">", "last_id", last_id, params))
         if end_id is not None:
-            conds.append("id <= :end_id")
-            params["end_id"] = end_id
+            conds.append(key.compare("<=", "end_id", end_id, params))
         where_sql = " AND ".join([c for c in conds if c and c.strip()])
         select_ids_sql = f"""
-            SELECT id FROM {source_table} {self.idxs.get(source_table)}
+            SELECT {key.cols()} FROM {source_table} {self.idxs.get(source_table)}
             WHERE {where_sql}
-            ORDER BY id
+            ORDER BY {key.cols()}
             LIMIT {batch_size}
         """
         return select_ids_sql, params
 
-    def process_with_join_mode(self, conn, source_table, dest_table, id_list, virtual_json_fields,
-                               physical_fields, id_sql_type, do_delete):
-        """使用临时表JOIN模式处理归档"""
-        n_chk, n_ins, n_del, t_chk, t_ins, t_del = 0, 0, 0, 0, 0, 0
-        temp_id_type = id_sql_type or 'varchar(128)'
+    def fetch_batch_ids(self, conn, source_table, where_clause, last_id, end_id, batch_size):
+        """在给定连接上查一批主键，返回 (id_list, 耗时ms)"""
+        select_ids_sql, params = self.query_batch_ids(source_table, where_clause, last_id, end_id, batch_size)
+        _ts = time.time()
+        res = conn.execute(text(select_ids_sql), params)
+        key = self.table_key(source_table)
+        id_list = [key.value(row) for row in res.fetchall()]
+        return id_list, int((time.time() - _ts) * 1000)
+
+    def create_temp_ids_table(self, conn, dest_table, key):
+        """创建并清空本连接的主键临时表（列与游标键一致），返回表名"""
         temp_table_name = f"temp_ids_{dest_table}"
-
-        # 创建临时表
+        columns = ", ".join(f"{c} {t or 'varchar(128)'} NOT NULL" for c, t in zip(key.columns, key.types))
         conn.execute(text(
-            f"CREATE TEMPORARY TABLE IF NOT EXISTS {temp_table_name} (id {temp_id_type} PRIMARY KEY) ENGINE=Memory DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci"))
+            f"CREATE TEMPORARY TABLE IF NOT EXISTS {temp_table_name} ({columns}, PRIMARY KEY ({key.cols()})) ENGINE=Memory DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci"))
         conn.execute(text(f"TRUNCATE TABLE {temp_table_name}"))
+        return temp_table_name
+
+    def select_ids_into_temp(self, conn, source_table, dest_table, where_clause, last_id, end_id, batch_size,
+                             key):
+        """
+        服务端物化一批主键：INSERT INTO 临时表 SELECT id ... LIMIT n，
+        只取回行数和首尾id推进游标，主键不经过客户端往返
+        返回 (行数, 首id, 尾id, 耗时ms)
+        """
+        temp_table_name = self.create_temp_ids_table(conn, dest_table, key)
+        select_ids_sql, params = self.query_batch_ids(source_table, where_clause, last_id, end_id, batch_size)
+        _ts = time.time()
+        conn.execute(text(f"INSERT INTO {temp_table_name} ({key.cols()}) {select_ids_sql}"), params)
+        if key.single:
+            n_sel, first_id, batch_last_id = conn.execute(
+                text(f"SELECT COUNT(*), MIN({key.cols()}), MAX({key.cols()}) FROM {temp_table_name}")).fetchone()
+        else:
+            n_sel = conn.execute(text(f"SELECT COUNT(*) FROM {temp_table_name}")).scalar()
+            first_id, batch_last_id = [
+                key.value(row) if row else None for row in (conn.execute(text(
+                    f"SELECT {key.cols()} FROM {temp_table_name} ORDER BY {key.cols(desc=desc)} LIMIT 1")).fetchone()
+                    for desc in (False, True))]
+        return n_sel, first_id, batch_last_id, int((time.time() - _ts) * 1000)
+
+    def process_with_join_mode(self, conn, source_table, dest_table, id_list, virtual_json_fields,
+                               physical_fields, key, do_delete):
+        """使用临时表JOIN模式处理归档，id_list 为 None 时临时表已由 select_ids_into_temp 填充"""
+        n_chk, n_ins, n_del, t_chk, t_ins, t_del = 0, 0, 0, 0, 0, 0
+        temp_table_name = f"temp_ids_{dest_table}"
 
-        # 批量插入临时表
-        insert_params = {f"id_{i}": v for i, v in enumerate(id_list)}
-        insert_values = ','.join([f"(:{k})" for k in insert_params.keys()])
         _tc = time.time()
-        conn.execute(text(f"INSERT INTO {temp_table_name} (id) VALUES {insert_values}"), insert_params)
+        if id_list is not None:
+            # 创建临时表
+            self.create_temp_ids_table(conn, dest_table, key)
+
+            # 批量插入临时表
+            insert_params = {}
+            placeholders = key.placeholders(id_list, insert_params)
+            insert_values = ','.join(p if p.startswith("(") else f"({p})" for p in placeholders)
+            _tc = time.time()
+            conn.execute(text(f"INSERT INTO {temp_table_name} ({key.cols()}) VALUES {insert_values}"), insert_params)
 
         # 校验已归档
-        archived_sql = f"SELECT t.id FROM {temp_table_name} t JOIN {dest_table} d ON d.id=t.id"
+        archived_sql = f"SELECT {key.cols('t')} FROM {temp_table_name} t JOIN {dest_table} d ON {key.join_on('d', 't')}"
         result = conn.execute(text(archived_sql))
         t_chk = int((time.time() - _tc) * 1000)
         n_chk = result.rowcount
@@ -214,18 +1719,18 @@ class ArchiveManager:
                 INSERT INTO {dest_table} ({fields_str})
                 SELECT {s_fields_str}
                 FROM {source_table} s
-                JOIN {temp_table_name} t ON s.id=t.id
-                LEFT JOIN {dest_table} d ON s.id=d.id
-                WHERE d.id IS NULL
+                JOIN {temp_table_name} t ON {key.join_on('s', 't')}
+                LEFT JOIN {dest_table} d ON {key.join_on('s', 'd')}
+                WHERE d.{key.columns[0]} IS NULL
             """
         else:
             join_insert_sql = f"""
                 INSERT INTO {dest_table}
                 SELECT s.*
                 FROM {source_table} s
-                JOIN {temp_table_name} t ON s.id=t.id
-                LEFT JOIN {dest_table} d ON s.id=d.id
-                WHERE d.id IS NULL
+                JOIN {temp_table_name} t ON {key.join_on('s', 't')}
+                LEFT JOIN {dest_table} d ON {key.join_on('s', 'd')}
+                WHERE d.{key.columns[0]} IS NULL
             """
         _ti = time.time()
         result = conn.execute(text(join_insert_sql))
@@ -238,8 +1743,8 @@ class ArchiveManager:
         if do_delete:
             del_sql = f"""
                 DELETE s FROM {source_table} s
-                JOIN {dest_table} d ON s.id=d.id
-                JOIN {temp_table_name} t ON s.id=t.id
+                JOIN {dest_table} d ON {key.join_on('s', 'd')}
+                JOIN {temp_table_name} t ON {key.join_on('s', 't')}
             """
             _td = time.time()
             result = conn.execute(text(del_sql))
@@ -254,19 +1759,20 @@ class ArchiveManager:
                              physical_fields, do_delete):
         """使用IN模式处理归档"""
         n_chk, n_ins, n_del, t_chk, t_ins, t_del = 0, 0, 0, 0, 0, 0
+        key = self.table_key(source_table)
 
         # 构造 IN 参数
-        id_params = {f"id_{i}": v for i, v in enumerate(id_list)}
-        in_clause = ','.join([f":{k}" for k in id_params.keys()])
+        id_params = {}
+        in_clause = key.in_list(id_list, id_params)
 
         # 查归档表已存在的 id
         select_archived_sql = f"""
-            SELECT id FROM {dest_table} WHERE id IN ({in_clause})
+            SELECT {key.cols()} FROM {dest_table} WHERE {in_clause}
         """
         _tc = time.time()
         res = conn.execute(text(select_archived_sql), id_params)
         t_chk = int((time.time() - _tc) * 1000)
-        archived_ids = set(row[0] for row in res.fetchall())
+        archived_ids = set(key.value(row) for row in res.fetchall())
         n_chk = res.rowcount
         if self.slow_ms > 0:
             self.logger.info(f"阶段-校验已归档: {t_chk} ms, 已存在 {n_chk}")
@@ -282,16 +1788,16 @@ class ArchiveManager:
             n_del += 1
 
         if to_insert_ids:
-            insert_params = {f"id_{i}": v for i, v in enumerate(to_insert_ids)}
-            insert_in_clause = ','.join([f":{k}" for k in insert_params.keys()])
+            insert_params = {}
+            insert_in_clause = key.in_list(to_insert_ids, insert_params)
             if virtual_json_fields:
                 fields_str = ','.join(physical_fields)
                 insert_sql = f"""
-                    INSERT INTO {dest_table} ({fields_str}) SELECT {fields_str} FROM {source_table} FORCE INDEX(`PRIMARY`) WHERE id IN ({insert_in_clause})
+                    INSERT INTO {dest_table} ({fields_str}) SELECT {fields_str} FROM {source_table} {key.hint} WHERE {insert_in_clause}
                 """
             else:
                 insert_sql = f"""
-                    INSERT INTO {dest_table} SELECT * FROM {source_table} FORCE INDEX(`PRIMARY`) WHERE id IN ({insert_in_clause})
+                    INSERT INTO {dest_table} SELECT * FROM {source_table} {key.hint} WHERE {insert_in_clause}
                 """
             _ti = time.time()
             conn.execute(text(insert_sql), insert_params)
@@ -302,10 +1808,9 @@ class ArchiveManager:
         if do_delete:
             ids_to_remove = to_delete_ids + to_insert_ids
             if ids_to_remove:
-                del_params = {f"id_{i}": v for i, v in enumerate(ids_to_remove)}
-                del_in_clause = ','.join([f":{k}" for k in del_params.keys()])
+                del_params = {}
                 delete_sql = f"""
-                    DELETE FROM {source_table} WHERE id IN ({del_in_clause})
+                    DELETE FROM {source_table} WHERE {key.in_list(ids_to_remove, del_params)}
                 """
                 _td = time.time()
                 conn.execute(text(delete_sql), del_params)
@@ -315,21 +1820,267 @@ class ArchiveManager:
 
         return n_chk, n_ins, n_del, t_chk, t_ins, t_del
 
+    def process_with_range_mode(self, conn, source_table, dest_table, where_clause, id_list, virtual_json_fields,
+                                physical_fields, do_delete):
+        """
+        使用连续区间模式处理归档：以 id BETWEEN :first_id AND :last_id AND 条件 表达一批，
+        语句只有两个绑定参数，走主键范围扫描；非整数主键或批次稀疏时回退 IN 模式
+        """
+        first_id, last_id = id_list[0], id_list[-1]
+        key = self.table_key(source_table)
+        if not key.single or not isinstance(first_id, int) or not isinstance(last_id, int) or \
+                len(id_list) / (last_id - first_id + 1) < self.range_density:
+            self.logger.debug(f"批次 {first_id}~{last_id} 密度不足 {self.range_density}，回退 IN 模式")
+            return self.process_with_in_mode(conn, source_table, dest_table, id_list, virtual_json_fields,
+                                             physical_fields, do_delete)
+
+        n_chk, n_ins, n_del, t_chk, t_ins, t_del = 0, 0, 0, 0, 0, 0
+        params = {"first_id": first_id, "last_id": last_id}
+        conds = [f"{key.cols()} BETWEEN :first_id AND :last_id"]
+        if where_clause and where_clause.strip():
+            conds.append(f"({where_clause})")
+        range_where = " AND ".join(conds)
+
+        # 插入未归档数据，已归档的行由 NOT EXISTS 跳过，省去单独的校验语句
+        # 条件中的列未加表前缀，用相关子查询而非 JOIN，避免与目标表同名列冲突
+        if virtual_json_fields:
+            fields_str = ','.join(physical_fields)
+            insert_sql = f"""
+                INSERT INTO {dest_table} ({fields_str}) SELECT {fields_str} FROM {source_table} {key.hint}
+                WHERE {range_where} AND NOT EXISTS (SELECT 1 FROM {dest_table} d WHERE {key.join_on('d', source_table)})
+            """
+        else:
+            insert_sql = f"""
+                INSERT INTO {dest_table} SELECT * FROM {source_table} {key.hint}
+                WHERE {range_where} AND NOT EXISTS (SELECT 1 FROM {dest_table} d WHERE {key.join_on('d', source_table)})
+            """
+        _ti = time.time()
+        n_ins = conn.execute(text(insert_sql), params).rowcount
+        t_ins = int((time.time() - _ti) * 1000)
+        n_chk = len(id_list) - n_ins
+        if n_ins and self.slow_ms > 0:
+            self.logger.info(f"阶段-插入归档: {t_ins} ms, 插入 {n_ins}")
+
+        # 只删除目标表中已存在的行
+        if do_delete:
+            delete_sql = f"""
+                DELETE FROM {source_table}
+                WHERE {range_where} AND EXISTS (SELECT 1 FROM {dest_table} d WHERE {key.join_on('d', source_table)})
+            """
+            _td = time.time()
+            n_del = conn.execute(text(delete_sql), params).rowcount
+            t_del = int((time.time() - _td) * 1000)
+            if n_del and self.slow_ms > 0:
+                self.logger.info(f"阶段-删除源表: {t_del} ms, 删除 {n_del}")
+
+        return n_chk, n_ins, n_del, t_chk, t_ins, t_del
+
+    def process_with_file_sink(self, conn, writer, source_table, id_list, physical_fields, do_delete):
+        """流式读出一批行写入归档文件，文件轮转落盘后再删除源表对应数据"""
+        n_chk, n_ins, n_del, t_chk, t_ins, t_del = 0, 0, 0, 0, 0, 0
+        key = self.table_key(source_table)
+
+        id_params = {}
+        in_clause = key.in_list(id_list, id_params)
+        fields_str = ','.join(physical_fields)
+        select_sql = f"""
+            SELECT {fields_str} FROM {source_table} {key.hint} WHERE {in_clause} ORDER BY {key.cols()}
+        """
+        _ti = time.time()
+        # 服务端游标逐行读取，避免整批行缓存在客户端
+        result = conn.execute(text(select_sql).execution_options(stream_results=True), id_params)
+        n_ins = writer.write_rows(result.keys(), result, key.indexes_in(physical_fields))
+        t_ins = int((time.time() - _ti) * 1000)
+        if n_ins and self.slow_ms > 0:
+            self.logger.info(f"阶段-写入文件: {t_ins} ms, 写入 {n_ins}")
+
+        if writer.should_rotate():
+            _td = time.time()
+            n_del = self.flush_file_sink(writer, source_table, id_list[-1], do_delete)
+            t_del = int((time.time() - _td) * 1000)
+
+        return n_chk, n_ins, n_del, t_chk, t_ins, t_del
+
+    def flush_file_sink(self, writer, source_table, last_id, do_delete):
+        """关闭并落盘当前文件，再按批分事务删除源表已落盘的行，返回删除行数"""
+        path = writer.path
+        ids = writer.rotate(last_id)
+        self.logger.info(f"归档文件落盘: {path}, {len(ids)} 行")
+        n_del = 0
+        if not do_delete:
+            return n_del
+        key = self.table_key(source_table)
+        chunk_size = self.split_delete if self.split_delete > 0 else self.batch_size
+        for i in range(0, len(ids), chunk_size):
+            del_params = {}
+            del_in_clause = key.in_list(ids[i:i + chunk_size], del_params)
+            n_del += self.execute_with_retry(source_table, f"DELETE FROM {source_table} WHERE {del_in_clause}",
+                                             del_params)
+        if n_del and self.slow_ms > 0:
+            self.logger.info(f"阶段-删除源表: 删除 {n_del}")
+        return n_del
+
+    @staticmethod
+    def _load_data_value(value):
+        """转为 LOAD DATA 默认格式 (\\t 分隔, \\n 换行, \\ 转义) 的字节串"""
+        if value is None:
+            return b"\\N"
+        if isinstance(value, bytes):
+            raw = value
+        elif isinstance(value, bool):
+            raw = b"1" if value else b"0"
+        else:
+            raw = str(value).encode("utf-8")
+        return (raw.replace(b"\\", b"\\\\").replace(b"\t", b"\\t").replace(b"\n", b"\\n")
+                .replace(b"\r", b"\\r").replace(b"\0", b"\\0"))
+
+    def bulk_write_dest(self, dest_conn, dest_table, fields, rows):
+        """向目标库批量写入一组行，返回写入行数"""
+        if not rows:
+            return 0
+        fields_str = ','.join(fields)
+        if self.bulk_mode == "load":
+            # PyMySQL 的 LOCAL INFILE 只能读文件，放在内存文件系统上减少落盘
+            tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+            with tempfile.NamedTemporaryFile(dir=tmp_dir, suffix=".tsv") as f:
+                for row in rows:
+                    f.write(b"\t".join(self._load_data_value(v) for v in row) + b"\n")
+                f.flush()
+                result = dest_conn.execute(text(
+                    f"LOAD DATA LOCAL INFILE :path INTO TABLE {dest_table} CHARACTER SET utf8mb4 ({fields_str})"),
+                    {"path": f.name})
+            return result.rowcount
+        # executemany 由 PyMySQL 合并为多行 INSERT ... VALUES
+        values_str = ','.join([f":f{i}" for i in range(len(fields))])
+        dest_conn.execute(text(f"INSERT INTO {dest_table} ({fields_str}) VALUES ({values_str})"),
+                          [{f"f{i}": v for i, v in enumerate(row)} for row in rows])
+        return len(rows)
+
+    def process_with_remote_dest(self, conn, source_table, dest_table, id_list, physical_fields, do_delete):
+        """跨实例归档：源库流式读出行，批量写入目标库，目标库提交后再删除源表"""
+        n_chk, n_ins, n_del, t_chk, t_ins, t_del = 0, 0, 0, 0, 0, 0
+        key = self.table_key(source_table)
+
+        id_params = {}
+        in_clause = key.in_list(id_list, id_params)
+
+        with self.dest_engine.begin() as dest_conn:
+            # 查归档表已存在的 id
+            _tc = time.time()
+            res = dest_conn.execute(text(f"SELECT {key.cols()} FROM {dest_table} WHERE {in_clause}"), id_params)
+            archived_ids = set(key.value(row) for row in res.fetchall())
+            t_chk = int((time.time() - _tc) * 1000)
+            n_chk = len(archived_ids)
+            if self.slow_ms > 0:
+                self.logger.info(f"阶段-校验已归档: {t_chk} ms, 已存在 {n_chk}")
+
+            to_insert_ids = [i for i in id_list if i not in archived_ids]
+            if to_insert_ids:
+                insert_params = {}
+                insert_in_clause = key.in_list(to_insert_ids, insert_params)
+                fields_str = ','.join(physical_fields)
+                select_sql = f"""
+                    SELECT {fields_str} FROM {source_table} {key.hint} WHERE {insert_in_clause}
+                """
+                _ti = time.time()
+                # 无缓冲游标分段读取，边读边写
+                result = conn.execute(text(select_sql).execution_options(stream_results=True), insert_params)
+                for rows in result.partitions(5000):
+                    n_ins += self.bulk_write_dest(dest_conn, dest_table, physical_fields, rows)
+                t_ins = int((time.time() - _ti) * 1000)
+                if n_ins and self.slow_ms > 0:
+                    self.logger.info(f"阶段-插入归档: {t_ins} ms, 插入 {n_ins}")
+        # 目标库事务已提交，此后源表删除失败重跑时会被校验为已归档
+
+        if do_delete:
+            delete_sql = f"DELETE FROM {source_table} WHERE {in_clause}"
+            _td = time.time()
+            n_del = conn.execute(text(delete_sql), id_params).rowcount
+            t_del = int((time.time() - _td) * 1000)
+            if n_del and self.slow_ms > 0:
+                self.logger.info(f"阶段-删除源表: {t_del} ms, 删除 {n_del}")
+
+        return n_chk, n_ins, n_del, t_chk, t_ins, t_del
+
+    def execute_with_retry(self, table, sql, params):
+        """独立短事务执行一条写语句，锁等待超时(1205)/死锁(1213)时指数退避重试，返回影响行数"""
+        for attempt in range(self.lock_retries + 1):
+            try:
+                with self.engine.connect() as conn:
+                    if self.lock_wait_timeout <= 0:
+                        with conn.begin():
+                            return conn.execute(text(sql), params).rowcount
+                    # 会话变量随连接回到连接池，用完必须恢复，否则后续批次事务也会按该超时提前报 1205
+                    conn.execute(text(f"SET @archiver_lock_wait_timeout = @@SESSION.innodb_lock_wait_timeout, "
+                                      f"SESSION innodb_lock_wait_timeout = {int(self.lock_wait_timeout)}"))
+                    try:
+                        n = conn.execute(text(sql), params).rowcount
+                        conn.commit()
+                        return n
+                    finally:
+                        self.restore_lock_wait_timeout(conn)
+            except Exception as e:
+                errno = mysql_errno(e)
+                if errno not in (1205, 1213) or attempt >= self.lock_retries:
+                    raise
+                self.metrics.observe_error(table, e)
+                wait = min(0.1 * 2 ** attempt, 5.0) * random.uniform(0.5, 1.0)
+                self.logger.warning(f"{'死锁' if errno == 1213 else '锁等待超时'}，{wait:.2f}s 后第 {attempt + 1} 次重试")
+                time.sleep(wait)
+
+    def restore_lock_wait_timeout(self, conn):
+        """结束当前事务并恢复会话锁等待超时，恢复失败时作废该连接，不让它回到连接池"""
+        try:
+            conn.rollback()
+            conn.execute(text("SET SESSION innodb_lock_wait_timeout = @archiver_lock_wait_timeout"))
+            conn.commit()
+        except Exception as e:
+            self.logger.warning(f"恢复 innodb_lock_wait_timeout 失败，丢弃该连接: {e}")
+            conn.invalidate()
+
+    def delete_in_chunks(self, source_table, dest_table, id_list):
+        """
+        拆分提交模式的删除阶段：归档插入已提交后，按 split_delete 行分段删除源表，每段一个短事务，
+        持锁范围和时间都只有一小段；同库归档时只删除目标表中已存在的行
+        返回删除行数
+        """
+        key = self.table_key(source_table)
+        n_del = 0
+        for i in range(0, len(id_list), self.split_delete):
+            params = {}
+            conds = key.in_list(id_list[i:i + self.split_delete], params)
+            if not self.dest_engine:
+                conds += f" AND EXISTS (SELECT 1 FROM {dest_table} d WHERE {key.join_on('d', source_table)})"
+            n_del += self.execute_with_retry(source_table, f"DELETE FROM {source_table} WHERE {conds}", params)
+        return n_del
+
+    def query_lock_status(self):
+        """服务端全局行锁等待计数，用于计算归档期间的增量"""
+        rows = self.run_query_sql(
+            "SHOW GLOBAL STATUS WHERE Variable_name IN ('Innodb_row_lock_waits', 'Innodb_row_lock_time')")
+        return {row[0]: int(row[1]) for row in rows}
+
     @run_time
     def archive_table(self, source_table, dest_table, where_clause, batch_size=None,
-                      do_delete=None):
+                      do_delete=None, workers=None):
         """归档表的主方法"""
         # 覆盖默认参数（方法级优先级更高）
         if batch_size is None:
             batch_size = self.batch_size
         if do_delete is None:
             do_delete = self.do_delete
+        if workers is None:
+            workers = self.workers
 
-        virtual_json_fields, physical_fields, id_sql_type = self.get_table_fields(source_table)
+        virtual_json_fields, physical_fields, _ = self.get_table_fields(source_table)
+        partitions = self.get_table_partitions(source_table)
+        key = self.table_key(source_table)
 
         self.logger.info(f'归档表 {source_table} -> {dest_table}')
         self.logger.info(f"""条件 {where_clause}""")
         self.logger.debug(f"表 {source_table} 物理字段: {physical_fields}")
+        if key.columns != ("id",):
+            self.logger.info(f"表 {source_table} 游标键: {key}")
 
         if virtual_json_fields:
             self.logger.info(f"表 {source_table} 虚拟json字段:")
@@ -337,9 +2088,15 @@ class ArchiveManager:
                 self.logger.info(f"  {f['field']}")
         else:
             self.logger.info(f"表 {source_table} 没有虚拟json字段")
-
-        # 归档前结构检查
-        if self.check_schema:
+        if partitions:
+            self.logger.info(f"表 {source_table} 分区: {partitions[0]['method']}({partitions[0]['expression']}), "
+                             f"共 {len(partitions)} 个")
+        hint = self.idxs.get(source_table)
+        if hint and hint[len("FORCE INDEX("):-1] not in self.get_table_indexes(source_table):
+            self.logger.warning(f"表 {source_table} 不存在索引提示中的索引: {hint}")
+
+        # 归档前结构检查（文件归档没有目标表）
+        if self.check_schema and not self.sink:
             self.check_schema_compatibility(source_table, dest_table, physical_fields)
 
         if self.analyze:
@@ -350,61 +2107,523 @@ class ArchiveManager:
             self.logger.info("试运行模式：仅检查字段和统计")
             return
 
-        start_id, end_id = self.compute_boundary_ids(source_table, where_clause)
-        if end_id is None:
-            self.logger.info("没有符合条件的数据，直接结束")
-            return
-        self.logger.info(f"首尾ID: start_id={start_id}, end_id={end_id}")
+        progress = ArchiveProgress()
+        if self.expired():
+            self.logger.warning(f"已到截止时间，跳过 {source_table}")
+            progress.expired = True
+            return progress.summary()
+        lock_status = self.query_lock_status()
+
+        # 断点续传：直接使用断点中未完成的区间，跳过首尾ID计算
+        start_id = None
+        estimate_rows = None
+        saved = []
+        if self.checkpoint and self.resume:
+            saved = self.checkpoint.load(source_table, dest_table, where_clause)
+
+        # 分区快速路径只用于同库归档且删除源表
+        if not saved and partitions and self.partition_mode and do_delete and not self.sink and not self.dest_engine:
+            self.archive_partitions(source_table, dest_table, where_clause, partitions, physical_fields, progress)
+
+        if saved:
+            ranges = [(r["range_no"], r["last_id"], r["end_id"]) for r in saved if not r["done"]]
+            self.logger.info(f"从断点继续: 共 {len(saved)} 个区间, 未完成 {len(ranges)} 个: "
+                             f"{[(last_id, end) for _, last_id, end in ranges]}")
+        else:
+            start_id, end_id = self.compute_boundary_ids(source_table, where_clause)
+            if end_id is None and not progress.batches:
+                self.logger.info("没有符合条件的数据，直接结束")
+                return
+            if end_id is not None:
+                self.logger.info(f"首尾ID: start_id={start_id}, end_id={end_id}")
+                if self.count_all:
+                    estimate_rows = self.count_total_records(source_table, where_clause)
+
+            ranges = [] if end_id is None else [
+                (i, last_id, end) for i, (last_id, end) in enumerate(self.split_id_ranges(start_id, end_id, workers), 1)]
+            if workers > 1 and len(ranges) == 1:
+                self.logger.warning(f"主键 {start_id!r}~{end_id!r} 无法按整数切分，退化为单线程归档")
+            if self.checkpoint:
+                self.checkpoint.clear(source_table, dest_table, where_clause)
+                for range_no, last_id, end in ranges:
+                    self.checkpoint.save(source_table, dest_table, where_clause, range_no, end, last_id)
+
+        table_meta = (virtual_json_fields, physical_fields, key)
+        if ranges and self.progress_every > 0:
+            if estimate_rows is None:
+                estimate_rows = self.estimate_total_records(source_table, where_clause)
+                self.logger.info(f"EXPLAIN 估算待归档: ~{estimate_rows} 行")
+            progress.estimator = ProgressEstimator(estimate_rows, ranges, start_id, self.progress_every)
+
+        if len(ranges) == 1:
+            range_no, last_id, range_end = ranges[0]
+            self.archive_range(source_table, dest_table, where_clause, last_id, range_end, batch_size,
+                               do_delete, table_meta, progress, range_no)
+        elif ranges:
+            self.logger.info(f"分片并发归档: {len(ranges)} 个线程, 区间 {[r[1:] for r in ranges]}")
+            prefix = getattr(_log_ctx, "prefix", "")
+            with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix="archiver") as pool:
+                futures = [
+                    pool.submit(run_with_log_prefix, f"{prefix}[w{range_no}] ", self.archive_range,
+                                source_table, dest_table, where_clause, last_id, range_end, batch_size,
+                                do_delete, table_meta, progress, range_no)
+                    for range_no, last_id, range_end in ranges
+                ]
+                for future in futures:
+                    future.result()
+
+        # 全部区间完成后清除断点，下次运行重新计算；到截止时间提前结束的保留断点
+        if self.checkpoint and not progress.expired:
+            self.checkpoint.clear(source_table, dest_table, where_clause)
+
+        summary = progress.summary()
+        if progress.expired:
+            self.logger.warning(f"{source_table} 已到截止时间，归档未完成" +
+                                ("，下次使用 --resume 从断点继续" if self.checkpoint else ""))
+        self.logger.info(
+            f"{'⏸' if progress.expired else '✅'}  {source_table} 归档{'暂停' if progress.expired else '完成'}, 总查询 {summary['queried']} 行, 总归档 {summary['archived']} 行, 总删除 {summary['deleted']} 行, 限流 {summary['throttle_ms']} ms")
+
+        # 阶段耗时分布汇总
+        self.metrics.set_server_stats(source_table, {k: v - lock_status.get(k, 0)
+                                                     for k, v in self.query_lock_status().items()})
+        self.logger.info(f"{source_table} 阶段耗时分布:")
+        for line in self.metrics.summary_lines(source_table):
+            self.logger.info(line)
+        self.metrics.maybe_write_textfile(force=True)
+        return summary
+
+    def _range_conds(self, key, where_clause, lo, hi, params):
+        conds = [f"({where_clause})"] if where_clause and where_clause.strip() else []
+        if lo is not None:
+            conds.append(key.compare(">", "lo", lo, params))
+        if hi is not None:
+            conds.append(key.compare("<=", "hi", hi, params))
+        return " AND ".join(conds) or "1=1"
+
+    def _row_hash_expr(self, physical_fields):
+        """行哈希表达式，ISNULL 标记区分 NULL 与空串（CONCAT_WS 会跳过 NULL）"""
+        cols = ','.join(physical_fields)
+        nulls = ','.join([f"ISNULL({f})" for f in physical_fields])
+        return f"CRC32(CONCAT_WS('#', {cols}, {nulls}))"
+
+    def checksum_chunk(self, table, engine, key, where_clause, physical_fields, lo, hi):
+        """返回 (行数, BIT_XOR(CRC32)) """
+        params = {}
+        sql = f"""
+            SELECT COUNT(*), COALESCE(BIT_XOR({self._row_hash_expr(physical_fields)}), 0)
+            FROM {table} WHERE {self._range_conds(key, where_clause, lo, hi, params)}
+        """
+        row = self.run_query_sql(sql, params, fetch="one", engine=engine)
+        return int(row[0]), int(row[1])
 
-        if self.count_all:
-            self.count_total_records(source_table, where_clause)
+    def chunk_boundaries(self, table, key, where_clause, lo, hi, chunk_size):
+        """沿主键按 chunk_size 行切分 (lo, hi]，返回 [(lo, b1), (b1, b2), ..., (bn, hi)]"""
+        bounds = []
+        last = lo
+        while True:
+            # 第 chunk_size 行即为块边界，不足一块时没有结果
+            params = {"n": chunk_size - 1}
+            conds = self._range_conds(key, where_clause, last, hi, params)
+            sql = f"""
+                SELECT {key.cols()} FROM {table} {self.idxs.get(table)} WHERE {conds}
+                ORDER BY {key.cols()} LIMIT 1 OFFSET :n
+            """
+            row = self.run_query_sql(sql, params, fetch="one")
+            if not row:
+                break
+            last = key.value(row)
+            bounds.append(last)
+            if hi is not None and last >= hi:
+                break
+        lows = [lo] + bounds
+        highs = bounds + [hi]
+        return [(a, b) for a, b in zip(lows, highs) if not (b is not None and a is not None and a >= b)]
+
+    def diff_rows(self, source_table, dest_table, key, where_clause, physical_fields, lo, hi):
+        """逐行比对小区间，返回 (目标缺失ids, 目标多出ids, 内容不一致ids)"""
+        def row_hashes(table, engine):
+            params = {}
+            sql = f"""
+                SELECT {key.cols()}, {self._row_hash_expr(physical_fields)} FROM {table}
+                WHERE {self._range_conds(key, where_clause, lo, hi, params)}
+            """
+            return {key.value(row): row[-1] for row in self.run_query_sql(sql, params, fetch="all", engine=engine)}
+
+        src = row_hashes(source_table, None)
+        dst = row_hashes(dest_table, self.dest_engine)
+        missing = sorted(set(src) - set(dst))
+        extra = sorted(set(dst) - set(src))
+        changed = sorted(i for i in set(src) & set(dst) if src[i] != dst[i])
+        return missing, extra, changed
+
+    def verify_chunk(self, source_table, dest_table, key, where_clause, physical_fields, lo, hi, chunk_size,
+                     drill_rows=100):
+        """校验一个区间，不一致时逐级细分，只对不一致的子区间继续下钻"""
+        src = self.checksum_chunk(source_table, None, key, where_clause, physical_fields, lo, hi)
+        dst = self.checksum_chunk(dest_table, self.dest_engine, key, where_clause, physical_fields, lo, hi)
+        if src == dst:
+            return []
+        if chunk_size <= drill_rows:
+            missing, extra, changed = self.diff_rows(source_table, dest_table, key, where_clause, physical_fields,
+                                                     lo, hi)
+            return [{"lo": lo, "hi": hi, "src_rows": src[0], "dst_rows": dst[0],
+                     "missing": missing, "extra": extra, "changed": changed}]
+        sub_size = max(drill_rows, chunk_size // 10)
+        mismatches = []
+        for sub_lo, sub_hi in self.chunk_boundaries(source_table, key, where_clause, lo, hi, sub_size):
+            mismatches += self.verify_chunk(source_table, dest_table, key, where_clause, physical_fields,
+                                            sub_lo, sub_hi, sub_size, drill_rows)
+        return mismatches
 
-        total_archived = 0
-        total_deleted = 0
-        total_queried = 0
-        last_id = None
+    @run_time
+    def verify_table(self, source_table, dest_table, where_clause, chunk_size=10000, workers=None):
+        """
+        分块校验源表与归档表：按主键切块比较 COUNT 与 BIT_XOR(CRC32(CONCAT_WS(物理字段)))，
+        多线程并行，只对不一致的块下钻到行级，返回不一致列表
+        """
+        workers = workers or self.workers
+        _, physical_fields, _ = self.get_table_fields(source_table)
+        key = self.table_key(source_table)
+        self.check_schema_compatibility(source_table, dest_table, physical_fields)
+        self.logger.info(f"校验表 {source_table} <-> {dest_table}, 条件 {where_clause}, 每块 {chunk_size} 行")
 
-        while True:
+        _, end_id = self.compute_boundary_ids(source_table, where_clause)
+        if end_id is None:
+            self.logger.info("源表没有符合条件的数据")
+            return []
+        # 首尾两块不设边界，目标表中超出源表id范围的行也会被校验到
+        chunks = self.chunk_boundaries(source_table, key, where_clause, None, None, chunk_size)
+        self.logger.info(f"共 {len(chunks)} 块，并发 {workers}")
+
+        prefix = getattr(_log_ctx, "prefix", "")
+        mismatches = []
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="archiver-verify") as pool:
+            futures = [pool.submit(run_with_log_prefix, prefix, self.verify_chunk, source_table, dest_table, key,
+                                   where_clause, physical_fields, lo, hi, chunk_size)
+                       for lo, hi in chunks]
+            for future in futures:
+                mismatches += future.result()
+
+        if not mismatches:
+            self.logger.info(f"✅  {source_table} 校验一致, 共 {len(chunks)} 块")
+            return mismatches
+        self.logger.error(f"❌  {source_table} 校验不一致, {len(mismatches)} 个区间:")
+        for m in mismatches:
+            self.logger.error(
+                f"  区间 ({m['lo']}, {m['hi']}]: 源 {m['src_rows']} 行, 目标 {m['dst_rows']} 行, "
+                f"目标缺失 {len(m['missing'])} {m['missing'][:20]}, 目标多出 {len(m['extra'])} {m['extra'][:20]}, "
+                f"内容不一致 {len(m['changed'])} {m['changed'][:20]}")
+        return mismatches
+
+    def partition_bound_covers(self, source_table, part, where_clause):
+        """
+        用分区上界快速判断整个分区是否满足 --where：条件形如 `分区列 < 值` / `分区列 <= 值`，
+        且分区上界 (VALUES LESS THAN) 不大于该值时，分区内所有行必然满足条件，无需扫描分区。
+        无法判断（条件更复杂、分区表达式含函数、MAXVALUE 等）时返回 False，由调用方扫描确认
+        """
+        column = (part["expression"] or "").strip().strip("`")
+        bound = part["description"]
+        if not re.fullmatch(r"\w+", column) or not bound or bound == "MAXVALUE":
+            return False
+        m = re.fullmatch(rf"\s*`?{column}`?\s*(<=?)\s*(.+?)\s*", where_clause, re.I | re.S)
+        if not m or re.search(r"\b(and|or|not)\b|;", m.group(2), re.I):
+            return False
+        types = {c["field"]: c["type"].lower() for c in self.get_table_meta(source_table)["columns"]}
+        col_type = types.get(column, "")
+        if col_type.startswith(("date", "timestamp")):
+            sql = f"SELECT CAST({bound} AS DATETIME(6)) <= CAST(({m.group(2)}) AS DATETIME(6))"
+        elif "int" in col_type or col_type.startswith("decimal"):
+            sql = f"SELECT {bound} <= ({m.group(2)})"
+        else:
+            return False
+        try:
+            return bool(self.run_query_sql(sql, scalar=True))
+        except Exception as e:
+            self.logger.debug(f"分区 {part['name']} 上界比较失败，改为扫描确认: {e}")
+            return False
+
+    def archive_stage_table(self, stage, dest_table, fields_str, key_on):
+        """
+        中转表数据写入目标表并确认全部已归档后删除中转表，返回 (写入行数, 中转表行数)
+        中转表是交换出来的分区数据的唯一副本，确认前不得删除
+        """
+        with self.engine.begin() as conn:
+            n_ins = conn.execute(text(f"""
+                INSERT INTO {dest_table} ({fields_str}) SELECT {fields_str} FROM {stage} s
+                WHERE NOT EXISTS (SELECT 1 FROM {dest_table} d WHERE {key_on})
+            """)).rowcount
+        with self.engine.connect() as conn:
+            n_rows, missing = conn.execute(text(f"""
+                SELECT COUNT(*), SUM(NOT EXISTS (SELECT 1 FROM {dest_table} d WHERE {key_on})) FROM {stage} s
+            """)).fetchone()
+            if missing:
+                raise Exception(f"中转表 {stage} 仍有 {missing} 行未归档，保留中转表")
+            conn.execute(text(f"DROP TABLE {stage}"))
+        return n_ins, n_rows
+
+    def check_partition_archived(self, source_table, dest_table, name, key_on):
+        """DROP PARTITION 前确认分区内所有行都已在目标表，防止搬迁期间有新写入；返回分区行数"""
+        with self.engine.connect() as conn:
+            n_rows, missing = conn.execute(text(f"""
+                SELECT COUNT(*), SUM(NOT EXISTS (SELECT 1 FROM {dest_table} d WHERE {key_on}))
+                FROM {source_table} PARTITION ({name}) s
+            """)).fetchone()
+        if missing:
+            raise Exception(f"分区 {name} 搬迁后仍有 {missing} 行未归档，停止 DROP PARTITION")
+        return n_rows
+
+    def archive_partitions(self, source_table, dest_table, where_clause, partitions, physical_fields, progress):
+        """
+        分区快速路径：按分区顺序检查，整个分区都满足归档条件时整体搬迁后 DROP PARTITION，
+        遇到第一个部分满足的分区（边界分区）即停止，剩余数据交给逐批归档
+        - exchange: 分区与空的中转表 EXCHANGE，源表瞬间清空该分区，再从中转表批量写入目标表，
+          确认中转表和分区内（交换后的新写入）所有行都已归档后才删除中转表、DROP PARTITION；
+          上次运行遗留的非空中转表先补归档，不会被覆盖
+        - copy: INSERT ... SELECT ... PARTITION (p) 整体复制，确认全部已归档后 DROP PARTITION
+        """
+        if not partitions or partitions[0]["method"] not in ("RANGE", "RANGE COLUMNS"):
+            return
+        if any(p["subpartition"] for p in partitions):
+            self.logger.info(f"表 {source_table} 含子分区，跳过分区快速路径")
+            return
+
+        fields_str = ','.join(physical_fields)
+        key_on = self.table_key(source_table).join_on("d", "s")
+        for part in partitions:
+            name = part["name"]
+            stage = f"{source_table}_x_{name}"[:64]
+            if self.partition_mode == "exchange" and self.run_query_sql(
+                    "SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :t",
+                    {"t": stage}, scalar=True):
+                # 上次运行在 EXCHANGE 之后中断，中转表可能是这部分数据的唯一副本
+                self.logger.warning(f"发现上次遗留的中转表 {stage}，先将其数据归档")
+                n_ins, n_rows = self.archive_stage_table(stage, dest_table, fields_str, key_on)
+                progress.add(n_rows, n_ins, n_rows)
+                self.logger.info(f"中转表 {stage} 补归档完成: 归档 {n_ins} 行, 共 {n_rows} 行")
+
+            with self.engine.connect() as conn:
+                if not conn.execute(text(f"SELECT 1 FROM {source_table} PARTITION ({name}) LIMIT 1")).fetchone():
+                    # 空分区（包括未来分区）不做处理
+                    continue
+            uncovered = False
+            if not self.partition_bound_covers(source_table, part, where_clause):
+                with self.engine.connect() as conn:
+                    # IS NOT TRUE 同时覆盖条件为 NULL 的行
+                    uncovered = conn.execute(text(
+                        f"SELECT 1 FROM {source_table} PARTITION ({name}) WHERE ({where_clause}) IS NOT TRUE LIMIT 1")
+                    ).fetchone()
+            if uncovered:
+                self.logger.info(f"分区 {name} 部分满足条件，作为边界分区交给逐批归档")
+                return
+
+            _tp = time.time()
+            self.logger.info(f"分区 {name} 全部满足条件 (约 {part['rows']} 行)，整体归档: {self.partition_mode}")
+            if self.partition_mode == "exchange":
+                with self.engine.connect() as conn:
+                    # 遗留中转表已在上面归档并删除，这里新建的一定是空表
+                    conn.execute(text(f"CREATE TABLE {stage} LIKE {source_table}"))
+                    conn.execute(text(f"ALTER TABLE {stage} REMOVE PARTITIONING"))
+                    conn.execute(text(f"ALTER TABLE {source_table} EXCHANGE PARTITION {name} WITH TABLE {stage}"))
+                self.logger.info(f"分区 {name} 已交换到中转表 {stage}")
+                n_ins, n_rows = self.archive_stage_table(stage, dest_table, fields_str, key_on)
+                # 交换后写入该分区的新数据未经过中转表，确认为空或已归档才能 DROP
+                n_new = self.check_partition_archived(source_table, dest_table, name, key_on)
+                with self.engine.connect() as conn:
+                    conn.execute(text(f"ALTER TABLE {source_table} DROP PARTITION {name}"))
+                n_rows += n_new
+            else:
+                with self.engine.begin() as conn:
+                    n_ins = conn.execute(text(f"""
+                        INSERT INTO {dest_table} ({fields_str}) SELECT {fields_str} FROM {source_table} PARTITION ({name}) s
+                        WHERE NOT EXISTS (SELECT 1 FROM {dest_table} d WHERE {key_on})
+                    """)).rowcount
+                n_rows = self.check_partition_archived(source_table, dest_table, name, key_on)
+                with self.engine.connect() as conn:
+                    conn.execute(text(f"ALTER TABLE {source_table} DROP PARTITION {name}"))
+
+            total_archived, total_deleted = progress.add(n_rows, n_ins, n_rows)
+            self.logger.info(f"分区 {name} 归档完成: 归档 {n_ins} 行, 删除 {n_rows} 行, "
+                             f"耗时 {int((time.time() - _tp) * 1000)} ms, 总归档 {total_archived}, 总删除 {total_deleted}")
+
+    def archive_tables(self, tables, table_suffix, where_clause, concurrency=1):
+        """
+        归档多张表，concurrency>1 时多表并发（各表独立占用连接池连接，日志带 [表名] 前缀），
+        某张表失败不影响其他表，全部结束后输出汇总并抛出失败
+        返回 {表名: 汇总结果}
+        """
+        results = {}
+        self.preload_schema(tables, table_suffix)
+        if concurrency <= 1:
+            for table in tables:
+                self.logger.info(f"{'-' * 30} 开始归档表: {table} {'-' * 30}")
+                results[table] = self.archive_table(table, f"{table}{table_suffix}", where_clause)
+        else:
+            self.logger.info(f"多表并发归档: 并发 {concurrency}, 表 {tables}")
+            prefix = getattr(_log_ctx, "prefix", "")
+            with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="archiver-table") as pool:
+                futures = {
+                    table: pool.submit(run_with_log_prefix, f"{prefix}[{table}] ", self.archive_table,
+                                       table, f"{table}{table_suffix}", where_clause)
+                    for table in tables
+                }
+                for table, future in futures.items():
+                    try:
+                        results[table] = future.result()
+                    except Exception as e:
+                        results[table] = {"error": str(e)}
+
+        self.logger.info(f"{'=' * 30} 归档汇总 {'=' * 30}")
+        totals = {"queried": 0, "archived": 0, "deleted": 0}
+        failed = []
+        for table, res in results.items():
+            if res is None:
+                self.logger.info(f"  {table}: 无数据或试运行")
+            elif "error" in res:
+                failed.append(table)
+                self.logger.error(f"  {table}: 失败 {res['error']}")
+            else:
+                for k in totals:
+                    totals[k] += res[k]
+                self.logger.info(f"  {table}: 查询 {res['queried']} 行, 归档 {res['archived']} 行, "
+                                 f"删除 {res['deleted']} 行, 限流 {res['throttle_ms']} ms"
+                                 f"{', 已到截止时间未完成' if res.get('expired') else ''}")
+        self.logger.info(f"  合计: 查询 {totals['queried']} 行, 归档 {totals['archived']} 行, 删除 {totals['deleted']} 行")
+        if failed:
+            raise Exception(f"以下表归档失败: {failed}")
+        return results
+
+    def archive_range(self, source_table, dest_table, where_clause, last_id, end_id, batch_size, do_delete,
+                      table_meta, progress, range_no=1):
+        """按游标归档 (last_id, end_id] 区间，每个分片线程各自占用一个连接池连接"""
+        virtual_json_fields, physical_fields, key = table_meta
+        save_checkpoint = None
+        if self.checkpoint:
+            save_checkpoint = self.checkpoint.bind(source_table, dest_table, where_clause, range_no, end_id)
+        # 每个分片各自调整批大小，不同id区间的行宽/冷热可能差异很大
+        sizer = AdaptiveBatchSizer(batch_size, self.target_ms, self.min_batch, self.max_batch, self.logger)
+        # 服务端物化主键只适用于同库 join 模式，此时主键不经过客户端，无需预取
+        # 拆分提交时删除阶段需要在客户端持有主键，退化为 join 模式
+        server_ids = self.check_mode == 'join-server' and not self.sink and not self.dest_engine and \
+            not (self.split_delete > 0 and do_delete)
+        prefetcher = None
+        if self.prefetch > 0 and not server_ids:
+            prefetcher = BatchPrefetcher(self, source_table, where_clause, last_id, end_id, sizer,
+                                         self.prefetch, progress.stop_event).start()
+        writer = None
+        if self.sink:
+            column_types = {c["field"]: c["type"] for c in self.get_table_meta(source_table)["columns"]}
+            writer = self.sink.open_writer(source_table, range_no, last_id, column_types)
+
+        try:
+            last_id = self._archive_loop(source_table, dest_table, where_clause, last_id, end_id, sizer, do_delete,
+                                         virtual_json_fields, physical_fields, key, progress, prefetcher,
+                                         save_checkpoint, writer, server_ids, range_no)
+            if writer and not progress.stop_event.is_set():
+                n_del = self.flush_file_sink(writer, source_table, last_id, do_delete)
+                progress.add(0, 0, n_del, batches=0)
+            elif writer:
+                # 其他分片出错中止，当前文件未落盘，关闭句柄并保留 .part
+                writer.abort()
+            if save_checkpoint and not progress.stop_event.is_set():
+                save_checkpoint(last_id, done=not progress.expired)
+            if progress.estimator and not progress.expired:
+                progress.estimator.finish(range_no)
+        except Exception:
+            if writer:
+                writer.abort()
+            raise
+        finally:
+            if prefetcher:
+                prefetcher.close()
+
+    def _archive_loop(self, source_table, dest_table, where_clause, last_id, end_id, sizer, do_delete,
+                      virtual_json_fields, physical_fields, key, progress, prefetcher, save_checkpoint=None,
+                      writer=None, server_ids=False, range_no=1):
+        """批次循环，返回最后提交的游标id"""
+        first_id = None
+        # 拆分提交：批次事务内只插入，删除在提交后分段进行（文件归档本身就在落盘后分段删除）
+        split = self.split_delete > 0 and do_delete and not writer
+        txn_delete = do_delete and not split
+        while not progress.stop_event.is_set():
+            if self.expired():
+                if not progress.expired:
+                    self.logger.warning(f"已到截止时间，停止归档, 当前游标id: {last_id}")
+                progress.expired = True
+                break
             t0 = time.time()
 
             try:
                 with self.engine.begin() as conn:
-                    # 1. 查一批主键
-                    select_ids_sql, params = self.query_batch_ids(source_table, where_clause, last_id, end_id,
-                                                                  batch_size)
-                    _ts = time.time()
-                    res = conn.execute(text(select_ids_sql), params)
-                    id_list = [row[0] for row in res.fetchall()]
-                    t_sel = int((time.time() - _ts) * 1000)
-                    n_sel = res.rowcount
-                    if not id_list:
+                    # 1. 查一批主键（流水线模式下从预取队列获取，join-server 模式在服务端写入临时表）
+                    if server_ids:
+                        id_list = None
+                        n_sel, batch_first_id, batch_last_id, t_sel = self.select_ids_into_temp(
+                            conn, source_table, dest_table, where_clause, last_id, end_id, sizer.size, key)
+                    else:
+                        if prefetcher:
+                            id_list, t_sel = prefetcher.get()
+                        else:
+                            id_list, t_sel = self.fetch_batch_ids(conn, source_table, where_clause, last_id,
+                                                                  end_id, sizer.size)
+                        n_sel = len(id_list)
+                        if id_list:
+                            batch_first_id, batch_last_id = id_list[0], id_list[-1]
+                    if not n_sel:
                         break
-                    total_queried += n_sel
                     if self.slow_ms > 0:
                         self.logger.info(f"阶段-查询: {t_sel} ms, 行数 {n_sel}")
 
                     # 2. 根据模式处理归档
-                    if self.check_mode == 'join':
+                    if writer:
+                        n_chk, n_ins, n_del, t_chk, t_ins, t_del = self.process_with_file_sink(
+                            conn, writer, source_table, id_list, physical_fields, do_delete)
+                    elif self.dest_engine:
+                        n_chk, n_ins, n_del, t_chk, t_ins, t_del = self.process_with_remote_dest(
+                            conn, source_table, dest_table, id_list, physical_fields, txn_delete)
+                    elif self.check_mode == 'range':
+                        n_chk, n_ins, n_del, t_chk, t_ins, t_del = self.process_with_range_mode(
+                            conn, source_table, dest_table, where_clause, id_list, virtual_json_fields,
+                            physical_fields, txn_delete)
+                    elif self.check_mode in ('join', 'join-server'):
                         n_chk, n_ins, n_del, t_chk, t_ins, t_del = self.process_with_join_mode(
                             conn, source_table, dest_table, id_list, virtual_json_fields,
-                            physical_fields, id_sql_type, do_delete)
+                            physical_fields, key, txn_delete)
                     else:
                         n_chk, n_ins, n_del, t_chk, t_ins, t_del = self.process_with_in_mode(
                             conn, source_table, dest_table, id_list, virtual_json_fields,
-                            physical_fields, do_delete)
-
-                    total_archived += n_ins
-                    total_deleted += n_del
+                            physical_fields, txn_delete)
 
                     # 3. 游标推进
-                    if not last_id:
-                        self.logger.info(f"首次游标id: {id_list[0]}")
-                    last_id = id_list[-1]
+                    if first_id is None:
+                        first_id = batch_first_id
+                        self.logger.info(f"首次游标id: {first_id}")
+
+                # 插入已提交，再分段删除源表；中途失败重跑时已归档的行会被校验跳过后删除
+                if split:
+                    _td = time.time()
+                    n_del = self.delete_in_chunks(source_table, dest_table, id_list)
+                    t_del = int((time.time() - _td) * 1000)
+                    if n_del and self.slow_ms > 0:
+                        self.logger.info(f"阶段-分段删除源表: {t_del} ms, 删除 {n_del}")
+                last_id = batch_last_id
             except Exception as e:
+                progress.stop_event.set()
+                self.metrics.observe_error(source_table, e)
                 self.logger.error(f"归档出错: {e}, 当前游标id: {last_id}")
                 raise e
 
+            # 事务已提交后再记录断点，中断重跑时最多重复处理一批（已归档的行会被校验跳过）
+            # 文件归档只记录已落盘的位置
+            if save_checkpoint:
+                save_checkpoint(writer.durable_id if writer else last_id)
+
+            total_archived, total_deleted = progress.add(n_sel, n_ins, n_del)
             elapsed_ms = int((time.time() - t0) * 1000)
+            self.metrics.observe_batch(source_table, t_sel, t_chk, t_ins, t_del, elapsed_ms, n_sel, n_ins, n_del)
+            if progress.estimator:
+                progress_msg = progress.estimator.update(range_no, last_id, n_sel)
+                if progress_msg:
+                    self.logger.info(progress_msg)
             self.logger.info(
                 f"当前游标id: {last_id}, 待归档: {n_sel} 行, 实际归档 {n_ins}, 删除: {n_del} 行, 总归档 {total_archived}, 总删除 {total_deleted}, 耗时 {elapsed_ms} ms")
 
@@ -413,8 +2632,25 @@ class ArchiveManager:
                 self.logger.info(
                     f"阶段耗时: select_ids={t_sel}ms/{n_sel} 行, check_archived={t_chk}ms/{n_chk} 行, insert={t_ins}ms/{n_ins} 行, delete={t_del}ms/{n_del} 行")
 
-        self.logger.info(
-            f"✅  {source_table} 归档完成, 总查询 {total_queried} 行, 总归档 {total_archived} 行, 总删除 {total_deleted} 行")
+            sizer.update(t_sel + t_chk + t_ins + t_del, n_sel)
+
+            # 4. 批次间限流，耗时单独统计，不计入批次耗时
+            t_thr = self.throttler.wait(n_sel, progress.stop_event)
+            if t_thr:
+                progress.add_throttle(t_thr)
+                self.metrics.observe_throttle(source_table, t_thr)
+                self.logger.info(f"限流等待: {t_thr} ms")
+
+        return last_id
+
+
+def parse_until(hhmm, now=None):
+    """HH:MM 转为下一次到达该时刻的时间戳"""
+    now = now or datetime.now()
+    until = datetime.combine(now.date(), datetime.strptime(hhmm, "%H:%M").time())
+    if until <= now:
+        until += timedelta(days=1)
+    return until.timestamp()
 
 
 # ========== 主入口 ==========
@@ -431,15 +2667,77 @@ def main():
     parser.add_argument("--where", default="",
                         help="""归档条件 (SQL 片段，不带 WHERE)，例如: "create_time < '2023-01-01'" """)
     parser.add_argument("-idxs", help="指定索引,格式: 表名=索引,... ")
+    parser.add_argument("--keys",
+                        help="指定游标键列(需唯一且非空)，格式: 表名=列1+列2,... 默认取主键，无主键时取第一个非空唯一索引")
     parser.add_argument("--batch", type=int, default=1000, help="每批行数 (默认 1000)")
     parser.add_argument("--delete", action="store_true", help="归档后是否删除源表数据")
     parser.add_argument("--debug", action="store_true", help="开启debug模式，输出详细日志和SQL")
     parser.add_argument("--skip-schema-check", action="store_true", help="跳过源表与目标表字段一致性检查")
     parser.add_argument("-c", action="store_true", help="启动时统计所有即将归档的")
+    parser.add_argument("--schema-cache",
+                        help="表结构缓存文件，按表结构校验和复用，结构不变时启动不再加载列/索引 (默认不落盘，仅本次运行内缓存)")
+    parser.add_argument("--until",
+                        help="截止时间 HH:MM，到点后在当前批次提交后停止（配合断点下次继续），用于限定在维护窗口内运行")
+    parser.add_argument("--progress-every", type=int, default=10,
+                        help="每N批输出一次进度百分比、行速率和预计剩余时间，基于 EXPLAIN 估算，不做全量COUNT (默认 10，0 关闭)")
     parser.add_argument("--dry-run", action="store_true", help="试运行模式，仅检查字段、统计数据，不执行归档")
     parser.add_argument("--slow-ms", type=int, default=0, help="慢批次阈值(ms)，>0时输出阶段耗时与慢批详情")
     parser.add_argument("--analyze", action="store_true", help="分析归档条件是否扫全表")
-    parser.add_argument("-m", choices=["in", "join"], default="in", help="校验模式：in(默认) 或 join(临时表)")
+    parser.add_argument("-m", choices=["in", "join", "join-server", "range"], default="in",
+                        help="校验模式：in(默认)、join(临时表)、join-server(服务端直接写临时表，主键不回传客户端) "
+                             "或 range(连续id区间，稀疏时回退in)")
+    parser.add_argument("--range-density", type=float, default=0.8,
+                        help="range 模式下批次行数/id跨度低于该值时回退 in 模式 (默认 0.8)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="单表按id区间切分的并发线程数 (默认 1，仅整数主键生效)")
+    parser.add_argument("--table-concurrency", type=int, default=1,
+                        help="多表并发归档的表数 (默认 1，逐表执行)")
+    parser.add_argument("--prefetch", type=int, default=0,
+                        help="流水线预取队列深度，>0时后台线程预取下一批id (默认 0 关闭)")
+    parser.add_argument("--target-ms", type=int, default=0,
+                        help="自适应批大小的目标批次耗时(ms)，>0时按实测耗时调整 --batch (默认 0 关闭)")
+    parser.add_argument("--min-batch", type=int, default=100, help="自适应批大小下限 (默认 100)")
+    parser.add_argument("--max-batch", type=int, default=50000, help="自适应批大小上限 (默认 50000)")
+    parser.add_argument("--max-threads-running", type=int, default=0,
+                        help="主库 Threads_running 超过该值时暂停归档 (默认 0 不检查)")
+    parser.add_argument("--replica", action="append", default=[],
+                        help="检查复制延迟的从库，可多次指定，格式: host:port 或完整 DSN (mysql+pymysql://...)")
+    parser.add_argument("--max-lag", type=int, default=0, help="从库延迟(秒)超过该值时暂停归档 (默认 0 不检查)")
+    parser.add_argument("--max-rows-per-sec", type=int, default=0, help="每秒归档行数上限 (默认 0 不限制)")
+    parser.add_argument("--throttle-interval", type=float, default=1.0, help="负载/延迟检查间隔(秒) (默认 1)")
+    parser.add_argument("--checkpoint-file", help="断点文件路径(JSON)，每批提交后记录游标")
+    parser.add_argument("--checkpoint-table", help="断点表名，在目标库中自动创建，与 --checkpoint-file 二选一")
+    parser.add_argument("--resume", action="store_true", help="从断点继续上次未完成的归档")
+    parser.add_argument("--sink", choices=["table", "file"], default="table",
+                        help="归档目标：table(默认，写入目标表) 或 file(写入压缩文件)")
+    parser.add_argument("--sink-dir", default="archive", help="文件归档目录 (默认 ./archive)")
+    parser.add_argument("--sink-format", choices=FileArchiveSink.FORMATS, default="jsonl",
+                        help="文件归档格式 (默认 jsonl)")
+    parser.add_argument("--sink-compression", choices=FileArchiveSink.COMPRESSIONS, default="gzip",
+                        help="文件归档压缩方式 (默认 gzip)")
+    parser.add_argument("--rotate-rows", type=int, default=1000000, help="单个归档文件最大行数 (默认 1000000)")
+    parser.add_argument("--dst-dsn",
+                        help="跨实例归档的目标库，格式: host:port/库名 (沿用源库账号密码) 或完整 DSN (mysql+pymysql://...)")
+    parser.add_argument("--partition-fast", choices=["exchange", "copy"],
+                        help="RANGE 分区表整分区满足条件时整体归档并 DROP PARTITION (需 --delete)："
+                             "exchange(交换到中转表) 或 copy(整体复制)，边界分区仍逐批归档")
+    parser.add_argument("--verify", action="store_true",
+                        help="校验模式：分块比较源表与归档表的行数和 CRC32 校验和，不执行归档，并发数使用 --workers")
+    parser.add_argument("--verify-chunk", type=int, default=10000, help="校验每块行数 (默认 10000)")
+    parser.add_argument("--metrics-file", help="Prometheus textfile collector 指标文件路径，运行中定期刷新")
+    parser.add_argument("--metrics-port", type=int, default=0, help="Prometheus 指标 HTTP 端口 (默认 0 不启动)")
+    parser.add_argument("--split-delete", type=int, default=0,
+                        help="拆分提交: 每批插入先提交，源表删除按N行分段、每段独立短事务，减少对业务的锁影响 (默认 0 关闭)")
+    parser.add_argument("--lock-retries", type=int, default=5,
+                        help="分段删除遇到锁等待超时/死锁时的重试次数，指数退避 (默认 5)")
+    parser.add_argument("--lock-wait-timeout", type=int, default=0,
+                        help="分段删除事务的 innodb_lock_wait_timeout(秒)，拿不到锁尽快让出并重试 (默认 0 使用服务端配置)")
+    parser.add_argument("--profile", metavar="PREFIX",
+                        help="性能剖析，结束时输出 PREFIX.pstats (cProfile)、PREFIX.collapsed (火焰图折叠栈)、PREFIX.sql.tsv (语句客户端/服务端耗时)")
+    parser.add_argument("--profile-mode", choices=["both", "sample"], default="both",
+                        help="both: cProfile+采样; sample: 只采样，开销更小 (默认 both)")
+    parser.add_argument("--bulk", choices=["executemany", "load"], default="executemany",
+                        help="跨实例写入方式：executemany(默认，多行INSERT) 或 load(LOAD DATA LOCAL INFILE)")
     args = parser.parse_args()
 
     # 设置日志
@@ -448,20 +2746,86 @@ def main():
     logger.debug(f"启动归档，debug模式: {args.debug}")
 
     db = f'mysql+pymysql://{args.u}:{args.p}@{args.ip}:{args.P if args.P else 3306}/{args.d}?charset=utf8mb4&use_unicode=True'
-    engine = create_engine(db, pool_recycle=3600, echo=args.debug)
+    # 每个分片线程独占一个连接，开启预取时再加一个；多表并发时按表数翻倍
+    conns = args.table_concurrency * args.workers * (2 if args.prefetch else 1)
+    engine = create_engine(db, pool_recycle=3600, pool_size=max(5, conns), echo=args.debug)
+
+    # 从库未给完整 DSN 时沿用主库账号密码
+    replica_engines = []
+    for replica in args.replica:
+        if "://" not in replica:
+            host, _, port = replica.partition(":")
+            replica = f'mysql+pymysql://{args.u}:{args.p}@{host}:{port or 3306}/?charset=utf8mb4'
+        replica_engines.append(create_engine(replica, pool_recycle=3600, pool_size=1))
+    throttler = ArchiveThrottler(engine, args.max_threads_running, replica_engines, args.max_lag,
+                                 args.max_rows_per_sec, args.throttle_interval)
+
+    dest_engine = None
+    if args.dst_dsn:
+        dst = args.dst_dsn
+        if "://" not in dst:
+            hostport, _, dst_db = dst.partition("/")
+            host, _, port = hostport.partition(":")
+            dst = f'mysql+pymysql://{args.u}:{args.p}@{host}:{port or 3306}/{dst_db or args.d}?charset=utf8mb4&use_unicode=True'
+        connect_args = {"local_infile": True} if args.bulk == "load" else {}
+        dest_engine = create_engine(dst, pool_recycle=3600, pool_size=max(5, args.table_concurrency * args.workers),
+                                    echo=args.debug, connect_args=connect_args)
+
+    checkpoint = None
+    if args.checkpoint_table:
+        checkpoint = TableCheckpointStore(dest_engine or engine, args.checkpoint_table)
+    elif args.checkpoint_file:
+        checkpoint = FileCheckpointStore(args.checkpoint_file)
+    if args.resume and not checkpoint:
+        parser.error("--resume 需要同时指定 --checkpoint-file 或 --checkpoint-table")
+
+    metrics = ArchiveMetrics(textfile=args.metrics_file)
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+        logger.info(f"指标端点: http://0.0.0.0:{args.metrics_port}/metrics")
+
+    sink = None
+    if args.sink == "file":
+        sink = FileArchiveSink(args.sink_dir, args.sink_format, args.sink_compression, args.rotate_rows)
 
     # 创建归档管理器
     archive_manager = ArchiveManager(engine, args.debug, args.slow_ms, args.m, idxs=args.idxs, batch_size=args.batch,
                                      do_delete=args.delete,
                                      check_schema=not args.skip_schema_check, count_all=args.c,
-                                     dry_run=args.dry_run, analyze=args.analyze)
+                                     dry_run=args.dry_run, analyze=args.analyze, workers=args.workers,
+                                     prefetch=args.prefetch, target_ms=args.target_ms, min_batch=args.min_batch,
+                                     max_batch=args.max_batch, throttler=throttler, checkpoint=checkpoint,
+                                     resume=args.resume, sink=sink, dest_engine=dest_engine, bulk_mode=args.bulk,
+                                     range_density=args.range_density, metrics=metrics,
+                                     partition_mode=args.partition_fast, progress_every=args.progress_every,
+                                     schema=SchemaCache(args.schema_cache), keys=args.keys,
+                                     deadline=parse_until(args.until) if args.until else None,
+                                     split_delete=args.split_delete, lock_retries=args.lock_retries,
+                                     lock_wait_timeout=args.lock_wait_timeout)
 
     tables = [t.strip() for t in args.t.split(",")]
     table_suffix = args.dst_suffix or "_history"
-    for table in tables:
-        logger.info(f"{'-' * 30} 开始归档表: {table} {'-' * 30}")
-        dest_table = f"{table}{table_suffix}"
-        archive_manager.archive_table(table, dest_table, args.where)
+    if args.verify and sink:
+        parser.error("--verify 不支持文件归档")
+
+    profiler = None
+    if args.profile:
+        profiler = ArchiveProfiler(args.profile, args.profile_mode, logger=logger)
+        for e in {engine, dest_engine} - {None}:
+            profiler.attach(e)
+        profiler.start()
+    try:
+        if args.verify:
+            failed = [table for table in tables
+                      if archive_manager.verify_table(table, f"{table}{table_suffix}", args.where, args.verify_chunk)]
+            if failed:
+                raise Exception(f"以下表校验不一致: {failed}")
+            return
+        archive_manager.archive_tables(tables, table_suffix, args.where, args.table_concurrency)
+    finally:
+        if profiler:
+            profiler.stop()
+            profiler.dump()
 
 
 if __name__ == "__main__":